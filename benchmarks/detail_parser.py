@@ -0,0 +1,166 @@
+import collections
+import tracemalloc
+import json
+import time
+import sys
+import os
+import click
+
+root_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, root_path)
+
+from craigslist_parser import CraigslistDetailParser
+
+default_fixtures = os.path.join(root_path, 'benchmarks', 'fixtures', 'craigslist')
+synthetic_fixtures = os.path.join(root_path, 'benchmarks', 'fixtures', 'synthetic')
+
+# Hand-written pages carry this marker, they are only good for checking that the engines agree
+synthetic_marker = b'<!-- synthetic'
+
+stages = {
+    'bs4': [
+        'build_soup',
+        'parse_rooms_and_availability',
+        'parse_dates_and_times',
+        'parse_images',
+        'parse_body',
+        'parse_address',
+        'parse_data_accuracy',
+        'geotag_result',
+    ],
+    'lxml': [
+        'extract',
+    ],
+}
+
+def load_pages(fixtures):
+    pages = []
+    for name in sorted(os.listdir(fixtures)):
+        if name.endswith('.html'):
+            with open(os.path.join(fixtures, name), 'rb') as file:
+                pages.append((name, file.read()))
+    return pages
+
+def is_synthetic(content):
+    return synthetic_marker in content[:200]
+
+def record_pages(urls, fixtures):
+    import requests
+
+    os.makedirs(fixtures, exist_ok=True)
+    for url in urls:
+        response = requests.get(url)
+        response.raise_for_status()
+        name = url.rstrip('/').rsplit('/', 1)[-1]
+        with open(os.path.join(fixtures, name if name.endswith('.html') else name + '.html'), 'wb') as file:
+            file.write(response.content)
+        click.echo(f'Recorded {url}')
+
+def timed(timings, name, function):
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timings[name] += time.perf_counter() - started
+    return wrapper
+
+def detail_parser(engine):
+    detail_parser = CraigslistDetailParser()
+    detail_parser.engine = engine
+    return detail_parser
+
+def measure_speed(pages, iterations, engine):
+    timings = collections.defaultdict(float)
+    timed_parser = detail_parser(engine)
+    for name in stages[engine]:
+        setattr(timed_parser, name, timed(timings, name, getattr(timed_parser, name)))
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for (name, content) in pages:
+            timed_parser.parse_content({'geotag': None}, content)
+    elapsed = time.perf_counter() - started
+
+    count = len(pages) * iterations
+    return (count / elapsed, {name: timings[name] / count * 1000 for name in stages[engine]})
+
+def measure_memory(pages, engine):
+    # Separate pass, tracemalloc slows everything down too much to time with it on
+    untimed_parser = detail_parser(engine)
+    peak = 0
+    for (name, content) in pages:
+        tracemalloc.start()
+        untimed_parser.parse_content({'geotag': None}, content)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return peak / 1024
+
+def check_engines(pages):
+    # Both engines have to produce the same listing fields
+    mismatches = []
+    for (name, content) in pages:
+        expected = detail_parser('bs4').parse_content({'geotag': None}, content)
+        actual = detail_parser('lxml').parse_content({'geotag': None}, content)
+        mismatches += [f'{name}: {key}' for key in sorted(set(expected) | set(actual)) if expected.get(key) != actual.get(key)]
+    return mismatches
+
+@click.command()
+@click.option('--fixtures', default=default_fixtures, help='Directory of saved detail pages')
+@click.option('--iterations', default=50, help='Times to replay the corpus')
+@click.option('--output', default=None, help='Write results as JSON, e.g. to use as a later baseline')
+@click.option('--baseline', default=None, help='JSON results to compare against')
+@click.option('--tolerance', default=0.2, help='Allowed slowdown or memory growth against the baseline')
+@click.option('--record', multiple=True, help='Save a live detail page URL into the fixtures directory')
+@click.option('--engine', default='bs4', type=click.Choice(['bs4', 'lxml']), help='Detail extraction engine to measure')
+
+def main(fixtures, iterations, output, baseline, tolerance, record, engine):
+    if record:
+        record_pages(record, fixtures)
+
+    pages = load_pages(fixtures)
+    if not pages:
+        click.echo(f'No .html fixtures found in {fixtures}, save real detail pages with --record <url> '
+            f'(or check engine parity only with --fixtures {os.path.relpath(synthetic_fixtures)})')
+        sys.exit(1)
+
+    mismatches = check_engines(pages)
+    for mismatch in mismatches:
+        click.echo(f'MISMATCH between bs4 and lxml engines: {mismatch}')
+
+    synthetic = [name for (name, content) in pages if is_synthetic(content)]
+    if synthetic:
+        # Speed and memory on hand-written pages say nothing about real ones
+        click.echo(f'Synthetic fixtures ({", ".join(synthetic)}): checked engine parity only, no speed or memory figures')
+        sys.exit(1 if mismatches else 0)
+
+    (pages_per_second, stage_times) = measure_speed(pages, iterations, engine)
+    peak_memory = measure_memory(pages, engine)
+    results = {'engine': engine, 'pages': len(pages), 'pages_per_second': pages_per_second, 'peak_memory_kb': peak_memory, 'stages_ms': stage_times}
+
+    click.echo(f'{engine}: {len(pages)} pages x {iterations}: {pages_per_second:.1f} pages/sec, peak {peak_memory:.0f} KiB per page')
+    for (name, milliseconds) in stage_times.items():
+        click.echo(f'    {milliseconds:8.3f}ms {name}')
+
+    if output:
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if baseline:
+        with open(baseline, 'r') as file:
+            baseline = json.load(file)
+
+        failures = []
+        if pages_per_second < baseline['pages_per_second'] * (1 - tolerance):
+            failures.append(f'pages/sec {pages_per_second:.1f} vs baseline {baseline["pages_per_second"]:.1f}')
+        if peak_memory > baseline['peak_memory_kb'] * (1 + tolerance):
+            failures.append(f'peak memory {peak_memory:.0f} KiB vs baseline {baseline["peak_memory_kb"]:.0f} KiB')
+
+        for failure in failures:
+            click.echo(f'REGRESSION: {failure}')
+        sys.exit(1 if failures or mismatches else 0)
+
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == '__main__':
+    main()
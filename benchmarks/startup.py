@@ -0,0 +1,65 @@
+import subprocess
+import sys
+import os
+import click
+
+# Cold import budgets for each bot entry point, in milliseconds
+default_budgets = {
+    'housing': 200,
+    'food_search': 200,
+    'dinner': 200,
+    'scheduler': 150,
+}
+
+root_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+def import_time(module):
+    # -X importtime reports "self | cumulative | name" in microseconds on stderr
+    command = [sys.executable, '-X', 'importtime', '-c', f'import {module}']
+    process = subprocess.run(command, cwd=root_path, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, universal_newlines=True)
+    if process.returncode != 0:
+        raise RuntimeError(f'Importing {module} failed:\n{process.stderr.strip().splitlines()[-1]}')
+
+    imports = []
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        (_, cumulative, name) = line[len('import time:'):].split('|')
+        imports.append((int(cumulative), name.rstrip()))
+
+    total = next(cumulative for (cumulative, name) in imports if name.strip() == module)
+    # Nested imports are indented two spaces per level, keep the ones imported directly
+    top_level = sorted((cumulative, name.strip()) for (cumulative, name) in imports if len(name) - len(name.lstrip()) == 3)
+    return (total / 1000, top_level[::-1][:5])
+
+@click.command()
+@click.option('--budget', multiple=True, help='Override a budget, e.g. --budget housing=400')
+@click.option('--runs', default=3, help='Import each entry point this many times and keep the fastest')
+
+def main(budget, runs):
+    budgets = dict(default_budgets)
+    for entry in budget:
+        (module, milliseconds) = entry.split('=')
+        budgets[module] = float(milliseconds)
+
+    failed = False
+    for (module, limit) in budgets.items():
+        try:
+            results = [import_time(module) for _ in range(runs)]
+        except RuntimeError as e:
+            click.echo(f'{module}: ERROR {e}')
+            failed = True
+            continue
+
+        (milliseconds, slowest) = min(results, key=lambda result: result[0])
+        status = 'ok' if milliseconds <= limit else 'OVER BUDGET'
+        click.echo(f'{module}: {milliseconds:.1f}ms (budget {limit:.0f}ms) {status}')
+        for (cumulative, name) in slowest:
+            click.echo(f'    {cumulative / 1000:8.1f}ms {name}')
+
+        failed = failed or milliseconds > limit
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+from slack.errors import SlackApiError
+from bot.metrics import Metrics
+
+import concurrent.futures
+import threading
+import asyncio
+import aiohttp
+import logging
+import time
+
+class TokenBucket():
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+
+    def pause(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class AsyncSlack():
+
+    api_url = 'https://slack.com/api/'
+
+    def __init__(self, token, channel_id, username, icon_url, rate=1.0, burst=1, pool_size=10, max_retries=5, metrics=None):
+        self.session = None
+        self.metrics = metrics or Metrics('slack')
+        self.queues = {}
+        self.workers = {}
+        self.buckets = {}
+
+        self.slack_token = token
+        self.slack_channel_id = channel_id
+        self.slack_username = username
+        self.slack_icon_url = icon_url
+
+        # Slack allows roughly one message per second per channel
+        self.rate = rate
+        self.burst = burst
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+
+    async def open(self):
+        connector = aiohttp.TCPConnector(limit=self.pool_size)
+        headers = {'Authorization': f'Bearer {self.slack_token}'}
+        self.session = aiohttp.ClientSession(connector=connector, headers=headers)
+
+    async def close(self):
+        await self.drain()
+
+        for worker in self.workers.values():
+            worker.cancel()
+        await asyncio.gather(*self.workers.values(), return_exceptions=True)
+        self.workers = {}
+
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def drain(self):
+        for channel_queue in list(self.queues.values()):
+            await channel_queue.join()
+
+    def bucket(self, channel):
+        if channel not in self.buckets:
+            self.buckets[channel] = TokenBucket(self.rate, self.burst)
+        return self.buckets[channel]
+
+    async def api_call(self, method, data, bucket=None):
+        data = {key: value for (key, value) in data.items() if value is not None}
+
+        for attempt in range(self.max_retries + 1):
+            if bucket:
+                await bucket.acquire()
+
+            self.metrics.increment('slack_calls')
+            started = time.perf_counter()
+            async with self.session.post(self.api_url + method, data=data) as response:
+                self.metrics.observe('slack_seconds', time.perf_counter() - started)
+                if response.status == 429:
+                    self.metrics.increment('slack_rate_limited')
+                    retry_after = float(response.headers.get('Retry-After', 1))
+                    logging.warning(f'Slack rate limited {method}, retrying after {retry_after}s')
+                    if bucket:
+                        bucket.pause(retry_after)
+                    else:
+                        await asyncio.sleep(retry_after)
+                    continue
+
+                result = await response.json()
+
+            if not result.get('ok'):
+                self.metrics.increment('slack_errors')
+                raise SlackApiError(f'Slack {method} failed: {result.get("error")}', result)
+            return result
+
+        raise SlackApiError(f'Slack {method} still rate limited after {self.max_retries} retries', {'ok': False, 'error': 'ratelimited'})
+
+    async def send_message_to_channel(self, message=None, attachments=None, thread_ts=None, channel=None):
+        channel = channel or self.slack_channel_id
+        post_message = await self.api_call('chat.postMessage', {
+            'text': message,
+            'channel': channel,
+            'as_user': 'false',
+            'unfurl_links': 'true',
+            'username': self.slack_username,
+            'icon_url': self.slack_icon_url,
+            'thread_ts': thread_ts,
+            'attachments': attachments,
+        }, bucket=self.bucket(channel))
+
+        logging.debug('Slack message result: %s', post_message)
+        return post_message
+
+    def enqueue(self, message=None, attachments=None, thread_ts=None, parent=None, channel=None):
+        # Messages for a channel are sent one at a time in queue order, so a reply
+        # queued with `parent` always goes out after its parent message has its `ts`
+        channel = channel or self.slack_channel_id
+        if channel not in self.queues:
+            self.queues[channel] = asyncio.Queue()
+            self.workers[channel] = asyncio.ensure_future(self.send_worker(self.queues[channel]))
+
+        result = asyncio.get_event_loop().create_future()
+        self.queues[channel].put_nowait((result, message, attachments, thread_ts, parent, channel))
+        return result
+
+    async def send_worker(self, channel_queue):
+        while True:
+            (result, message, attachments, thread_ts, parent, channel) = await channel_queue.get()
+            try:
+                if parent is not None:
+                    thread_ts = (await parent)['ts']
+                result.set_result(await self.send_message_to_channel(message, attachments, thread_ts, channel))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f'Failed to send Slack message: {e}')
+                result.set_exception(e)
+            finally:
+                channel_queue.task_done()
+
+class SlackQueue():
+
+    def __init__(self, async_slack):
+        self.async_slack = async_slack
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='slack', daemon=True)
+        self.thread.start()
+        self.call(self.async_slack.open()).result()
+
+    def call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def send_message_to_channel(self, message=None, attachments=None, thread_ts=None, parent=None):
+        async def send():
+            future_parent = asyncio.wrap_future(parent) if isinstance(parent, concurrent.futures.Future) else parent
+            return await self.async_slack.enqueue(message, attachments, thread_ts, future_parent)
+
+        return self.call(send())
+
+    def drain(self):
+        self.call(self.async_slack.drain()).result()
+
+    def close(self):
+        self.call(self.async_slack.close()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
@@ -0,0 +1,79 @@
+import hashlib
+import logging
+import struct
+import math
+import mmap
+import os
+
+class BloomFilter():
+
+    magic = b'BLM1'
+
+    # magic, hash count, bit count, capacity, item count, marker
+    header = struct.Struct('<4sIQQQQ')
+
+    def __init__(self, capacity, error_rate=0.001, bits=None, hashes=None, data=None, count=0, marker=0):
+        self.capacity = max(1, int(capacity))
+        self.bits = bits or self.optimal_bits(self.capacity, error_rate)
+        self.hashes = hashes or self.optimal_hashes(self.capacity, self.bits)
+        self.data = data if data is not None else bytearray((self.bits + 7) // 8)
+        self.count = count
+        # Free for the owner to record how far the filter is in sync with its source
+        self.marker = marker
+
+    @staticmethod
+    def optimal_bits(capacity, error_rate):
+        return int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+
+    @staticmethod
+    def optimal_hashes(capacity, bits):
+        return max(1, int(round(bits / capacity * math.log(2))))
+
+    def positions(self, key):
+        digest = hashlib.blake2b(str(key).encode('utf-8'), digest_size=16).digest()
+        (first, second) = struct.unpack('<QQ', digest)
+        return [(first + index * second) % self.bits for index in range(self.hashes)]
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.data[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        for position in self.positions(key):
+            if not self.data[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def is_full(self):
+        return self.count > self.capacity
+
+    def save(self, path):
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(self.header.pack(self.magic, self.hashes, self.bits, self.capacity, self.count, self.marker))
+            file.write(self.data)
+        os.replace(temp_path, path)
+        logging.debug(f'Saved bloom filter with {self.count} items to: {path}')
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, 'rb') as file:
+                # Copy-on-write mapping, pages are only read in when probed
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+        except (OSError, ValueError) as e:
+            logging.debug(f'Could not map bloom filter file: {path} ({e})')
+            return None
+
+        if len(mapped) < cls.header.size:
+            return None
+
+        (magic, hashes, bits, capacity, count, marker) = cls.header.unpack_from(mapped)
+        if magic != cls.magic or len(mapped) != cls.header.size + (bits + 7) // 8:
+            logging.warning(f'Ignoring invalid bloom filter file: {path}')
+            return None
+
+        data = memoryview(mapped)[cls.header.size:]
+        logging.debug(f'Loaded bloom filter with {count} items from: {path}')
+        return cls(capacity, bits=bits, hashes=hashes, data=data, count=count, marker=marker)
@@ -1,35 +1,97 @@
 from bot.slack import Slack
 from bot.logger import Logger
 from bot.configurator import Configurator
+from bot.metrics import Metrics, MetricsServer
 
 import os
-import logging
+import json
 
 class Bot():
 
     log_extension = 'log'
     config_extension = 'yaml'
+    channel_cache_extension = 'channels.json'
     
-    def __init__(self, log_file=None, log_level=None, config_file=None):
+    def __init__(self, log_file=None, log_level=None, config_file=None, autorun=True):
         if not log_file:
             log_file = self.default_file(self.log_extension)
 
         if not config_file:
             config_file = self.default_file(self.config_extension)
 
-        self.logger = Logger(log_file=log_file, log_level=log_level)
+        # The Logger comes first: anything logged before it has handlers would fall back to a stderr handler
+        self.logger = Logger(log_file=log_file, log_level=log_level, name=self.filename(), **Configurator.logging_options(config_file))
+        # Bots log through their own logger, so several can share a process without mixing their files
+        self.log = self.logger.logger
+
         self.config = Configurator(config_file=config_file)
 
         config = self.config.config
-        self.slack = Slack(token=config['slack']['token'], channel=config['slack']['channel'], username=config['slack']['username'], icon_url=config['slack']['icon_url'])
+        self.metrics = Metrics(self.filename())
+        self.metrics_config = config.get('metrics') or {}
+        self.metrics_server = None
+
+        self.slack = Slack(token=config['slack']['token'], channel=config['slack']['channel'], username=config['slack']['username'], icon_url=config['slack']['icon_url'],
+            cache_file=self.default_file(self.channel_cache_extension), cache_ttl=config['slack'].get('channel_cache_ttl', 86400), metrics=self.metrics)
+        self.slack_queue = None
+
+        if config['slack'].get('async'):
+            from bot.async_slack import AsyncSlack, SlackQueue
+
+            async_slack = AsyncSlack(token=config['slack']['token'], channel_id=self.slack.slack_channel_id, username=config['slack']['username'], icon_url=config['slack']['icon_url'],
+                rate=config['slack'].get('rate', 1.0), burst=config['slack'].get('burst', 1), metrics=self.metrics)
+            self.slack_queue = SlackQueue(async_slack)
 
         if not self.config_setup(config):
-            logging.error(f'Failed to parse required keys from config file')
+            self.log.error(f'Failed to parse required keys from config file')
             exit(1)
 
-        logging.info('Running bot')
-        self.run()
-        logging.info('Finished bot')
+        # Long-running (scheduled) bots can serve their metrics over HTTP
+        if not autorun and self.metrics_config.get('port') is not None:
+            self.metrics_server = MetricsServer(self.metrics, host=self.metrics_config.get('host', '127.0.0.1'), port=self.metrics_config['port'])
+            self.metrics_server.start()
+
+        # The scheduler builds bots once with autorun=False and calls execute() itself
+        if autorun:
+            try:
+                self.execute()
+            finally:
+                self.shutdown()
+
+    def execute(self):
+        self.log.info('Running bot')
+        self.metrics.start_run()
+        try:
+            with self.metrics.timer('run'):
+                self.run()
+                if self.slack_queue:
+                    with self.metrics.timer('slack_drain'):
+                        self.slack_queue.drain()
+        finally:
+            self.report_metrics()
+        self.log.info('Finished bot')
+
+    def report_metrics(self):
+        # One JSON line per run, in the log and optionally in its own file
+        summary = json.dumps(self.metrics.summary(), separators=(',', ':'))
+        self.log.info(f'Run metrics: {summary}')
+
+        try:
+            if self.metrics_config.get('summary_file'):
+                with open(self.metrics_config['summary_file'], 'a') as output:
+                    output.write(summary + '\n')
+            if self.metrics_config.get('textfile'):
+                self.metrics.write_textfile(self.metrics_config['textfile'])
+        except OSError as e:
+            self.log.error(f'Failed to write metrics: {e}')
+
+    def shutdown(self):
+        if self.metrics_server:
+            self.metrics_server.stop()
+            self.metrics_server = None
+        if self.slack_queue:
+            self.slack_queue.close()
+            self.slack_queue = None
     
     def default_file(self, extension):
         base_path = os.path.dirname(os.path.realpath(__file__))
@@ -42,4 +104,4 @@ class Bot():
         return True
 
     def run(self):
-        pass
\ No newline at end of file
+        pass
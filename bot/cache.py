@@ -0,0 +1,38 @@
+from sqlite3 import Error
+
+import contextlib
+import logging
+import sqlite3
+
+class SQLiteCache():
+
+    # Subclasses set their table and optionally a journal mode, and can migrate old files
+    create_statement = None
+    journal_mode = None
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.create_table()
+
+    @contextlib.contextmanager
+    def connect(self):
+        # Short lived connections so the cache can be used from worker threads
+        connection = sqlite3.connect(self.db_file, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def create_table(self):
+        try:
+            with self.connect() as connection:
+                if self.journal_mode:
+                    connection.execute(f'PRAGMA journal_mode = {self.journal_mode}')
+                connection.execute(self.create_statement)
+                self.migrate(connection)
+        except Error as e:
+            logging.error(e)
+
+    def migrate(self, connection):
+        pass
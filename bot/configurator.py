@@ -2,6 +2,9 @@ import yaml
 import traceback
 import logging
 
+# A named logger: records before the Logger is set up are dropped instead of calling basicConfig
+logger = logging.getLogger('bot.configurator')
+
 class Configurator():
 
     def __init__(self, config_file):
@@ -14,10 +17,19 @@ class Configurator():
         try:
             with open(self.config_file, 'r') as stream:
                 self.config = yaml.safe_load(stream)
-                logging.debug(f'Finished parsing yaml: {self.config_file}')
+                logger.debug(f'Finished parsing yaml: {self.config_file}')
         except Exception as e:
-            logging.error(traceback.format_exc())
+            logger.error(traceback.format_exc())
             exit(1)
         except yaml.YAMLError as e:
-            logging.error(e)
+            logger.error(e)
             exit(1)
+
+    @staticmethod
+    def logging_options(config_file):
+        # Read before the Logger exists, so nothing is logged here: setup_config reports a broken file once logging is up
+        try:
+            with open(config_file, 'r') as stream:
+                return (yaml.safe_load(stream) or {}).get('logging') or {}
+        except Exception:
+            return {}
@@ -0,0 +1,36 @@
+from functools import lru_cache
+
+import datetime
+import time
+
+# Relative phrases ("Posted 3 days ago") are resolved against the start of a window
+# this long, so cached answers stay consistent and go stale after at most one window
+relative_window = 600
+
+def parse_date(text):
+    # Most timestamps we scrape are ISO-8601, which needs no guessing
+    try:
+        return datetime.datetime.fromisoformat(text)
+    except ValueError:
+        return parse_date_cached(text)
+
+@lru_cache(maxsize=4096)
+def parse_date_cached(text):
+    from dateutil import parser
+    return parser.parse(text)
+
+def parse_fuzzy_date(text):
+    text = str(text)
+    try:
+        return datetime.datetime.fromisoformat(text)
+    except ValueError:
+        window = int(time.time() // relative_window) * relative_window
+        return parse_fuzzy_date_cached(text, window)
+
+@lru_cache(maxsize=4096)
+def parse_fuzzy_date_cached(text, window):
+    import dateparser
+
+    # Pinning the language skips dateparser's per-call language detection
+    settings = {'RELATIVE_BASE': datetime.datetime.fromtimestamp(window)}
+    return dateparser.parse(text, languages=['en'], settings=settings)
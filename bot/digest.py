@@ -0,0 +1,59 @@
+import threading
+import logging
+import json
+import time
+
+def entry_size(entry):
+    return len(entry) if isinstance(entry, str) else len(json.dumps(entry))
+
+class Digest():
+
+    # Collects entries during a run and sends them as a few chunked messages instead of one each.
+    # Pending entries are flushed once `threshold` are waiting, once the oldest has waited `window`
+    # seconds, or when the run calls flush(). Each message holds at most `per_message` entries
+    # whose combined size stays under `max_size`.
+    def __init__(self, send, threshold=50, window=300, per_message=10, max_size=3500):
+        self.send = send
+        self.threshold = threshold
+        self.window = window
+        self.per_message = per_message
+        self.max_size = max_size
+        self.pending = []
+        self.started = None
+        self.lock = threading.Lock()
+
+    def add(self, entry, key=0):
+        with self.lock:
+            if not self.pending:
+                self.started = time.monotonic()
+            self.pending.append((key, len(self.pending), entry))
+            due = len(self.pending) >= self.threshold or (self.window is not None and time.monotonic() - self.started >= self.window)
+
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            (pending, self.pending) = (self.pending, [])
+
+        entries = [entry for (key, index, entry) in sorted(pending, key=lambda item: item[:2])]
+        chunks = list(self.chunks(entries))
+        for (index, chunk) in enumerate(chunks):
+            self.send(chunk, index, len(chunks))
+
+        if entries:
+            logging.info(f'Sent digest of {len(entries)} entries in {len(chunks)} messages')
+
+    def chunks(self, entries, size_of=entry_size):
+        chunk = []
+        size = 0
+        for entry in entries:
+            length = size_of(entry)
+            if chunk and (len(chunk) >= self.per_message or size + length > self.max_size):
+                yield chunk
+                chunk = []
+                size = 0
+            chunk.append(entry)
+            size += length
+        if chunk:
+            yield chunk
@@ -0,0 +1,180 @@
+import hashlib
+import re
+
+street_suffixes = {
+    'street': 'st', 'st': 'st', 'avenue': 'ave', 'ave': 'ave', 'av': 'ave', 'road': 'rd', 'rd': 'rd',
+    'drive': 'dr', 'dr': 'dr', 'court': 'ct', 'ct': 'ct', 'lane': 'ln', 'ln': 'ln', 'way': 'way',
+    'boulevard': 'blvd', 'blvd': 'blvd', 'place': 'pl', 'pl': 'pl', 'terrace': 'ter', 'ter': 'ter',
+    'circle': 'cir', 'cir': 'cir', 'parkway': 'pkwy', 'pkwy': 'pkwy', 'highway': 'hwy', 'hwy': 'hwy',
+    'expressway': 'expy', 'expy': 'expy', 'square': 'sq', 'sq': 'sq', 'loop': 'loop', 'row': 'row',
+}
+
+directions = {'north': 'n', 'south': 's', 'east': 'e', 'west': 'w', 'n': 'n', 's': 's', 'e': 'e', 'w': 'w'}
+
+unit_pattern = re.compile(r'(?:\b(?:apt|apartment|unit|suite|ste)\b\.?|#)\s*([a-z0-9-]+)')
+
+def normalize_address(text):
+    # "123 Main Street, Mountain View" and "123 main st mountain view ca" both become "123 main st",
+    # "123 Main St Apt 4" and "123 main st #4" become "123 main st #4"
+    if not text:
+        return None
+
+    text = text.lower()
+    tokens = re.findall(r'[a-z0-9]+', text)
+    if not tokens or not tokens[0].isdigit():
+        return None
+
+    street = [tokens[0]]
+    for token in tokens[1:6]:
+        if token in street_suffixes:
+            street.append(street_suffixes[token])
+            unit = unit_pattern.search(text)
+            if unit:
+                street.append('#' + unit.group(1))
+            return ' '.join(street)
+        street.append(directions.get(token, token))
+    return None
+
+def parse_price(text):
+    if text is None:
+        return None
+    if isinstance(text, (int, float)):
+        return float(text)
+
+    digits = re.sub(r'[^\d.]', '', str(text).split('/')[0])
+    return float(digits) if digits else None
+
+def parse_rooms(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def parse_area(value):
+    # "1200ft2", "1,500 sqft" or 1500
+    match = re.search(r'\d[\d,]*(\.\d+)?', str(value)) if value is not None else None
+    return float(match.group(0).replace(',', '')) if match else None
+
+def listing_coordinates(listing):
+    if listing.get('geotag'):
+        return (float(listing['geotag'][0]), float(listing['geotag'][1]))
+    if listing.get('gcoords'):
+        try:
+            return (float(listing['gcoords']['lat']), float(listing['gcoords']['long']))
+        except (KeyError, TypeError, ValueError):
+            return None
+    return None
+
+def simhash(text, bits=64):
+    # Near-identical texts get hashes a few bits apart; word 3-shingles so reordering sentences still counts
+    words = re.findall(r'\w+', (text or '').lower())
+    if len(words) < 8:
+        return None
+
+    weights = [0] * bits
+    for index in range(len(words) - 2):
+        shingle = ' '.join(words[index:index + 3]).encode('utf-8')
+        value = int.from_bytes(hashlib.blake2b(shingle, digest_size=bits // 8).digest(), 'big')
+        for bit in range(bits):
+            weights[bit] += 1 if value >> bit & 1 else -1
+
+    return sum(1 << bit for bit in range(bits) if weights[bit] > 0)
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+class Fingerprint():
+
+    # A 64-bit simhash split in 4 bands: hashes within 3 bits of each other share at least one band
+    bands = 4
+    band_bits = 16
+
+    def __init__(self, listing_id, address=None, cell=None, bedrooms=None, bathrooms=None, price_band=None, body_hash=None):
+        self.listing_id = str(listing_id)
+        self.address = address
+        self.cell = cell
+        self.bedrooms = bedrooms
+        self.bathrooms = bathrooms
+        self.price_band = price_band
+        self.body_hash = body_hash
+
+    @classmethod
+    def from_listing(cls, listing, cell_size=0.001, price_band=250):
+        coordinates = listing_coordinates(listing)
+        cell = (int(coordinates[0] // cell_size), int(coordinates[1] // cell_size)) if coordinates else None
+        price = parse_price(listing.get('price'))
+
+        return cls(listing['id'],
+            address=normalize_address(listing.get('gaddress')),
+            cell=cell,
+            bedrooms=parse_rooms(listing.get('bedrooms')),
+            bathrooms=parse_rooms(listing.get('bathrooms')),
+            price_band=int(price // price_band) if price else None,
+            body_hash=simhash(listing.get('body')))
+
+    @classmethod
+    def from_row(cls, row):
+        (listing_id, address, cell_lat, cell_lon, bedrooms, bathrooms, price_band, body_hash) = row[:8]
+        cell = (cell_lat, cell_lon) if cell_lat is not None else None
+        return cls(listing_id, address, cell, bedrooms, bathrooms, price_band, unsigned(body_hash))
+
+    def row(self):
+        (cell_lat, cell_lon) = self.cell or (None, None)
+        return (self.listing_id, self.address, cell_lat, cell_lon, self.bedrooms, self.bathrooms, self.price_band, signed(self.body_hash)) + self.body_bands()
+
+    def body_bands(self):
+        if self.body_hash is None:
+            return (None,) * self.bands
+        mask = (1 << self.band_bits) - 1
+        return tuple(self.body_hash >> (index * self.band_bits) & mask for index in range(self.bands))
+
+    def searchable(self):
+        return self.body_hash is not None or (self.address is not None and self.bedrooms is not None and self.price_band is not None)
+
+    def cell_range(self):
+        # Bounds of the neighbouring cells, (None,) * 4 when the listing has no coordinates
+        if self.cell is None:
+            return (None,) * 4
+        return (self.cell[0] - 1, self.cell[0] + 1, self.cell[1] - 1, self.cell[1] + 1)
+
+    def same_layout(self, other):
+        if self.bedrooms is None or self.bedrooms != other.bedrooms:
+            return False
+        if self.bathrooms is not None and other.bathrooms is not None and self.bathrooms != other.bathrooms:
+            return False
+        if self.price_band is None or other.price_band is None or abs(self.price_band - other.price_band) > 1:
+            return False
+        return True
+
+    def near(self, other):
+        # The same or a neighbouring grid cell, so a boundary between cells doesn't hide a match
+        if self.cell is None or other.cell is None:
+            return False
+        return abs(self.cell[0] - other.cell[0]) <= 1 and abs(self.cell[1] - other.cell[1]) <= 1
+
+    def matches(self, other, max_distance=3, cell_distance=18):
+        # Two different street addresses (other units of one complex too) are never the same listing.
+        # Otherwise a near identical text, or the same address with the same layout and price. Listings of
+        # one place on different sites rarely share a text exactly, so in neighbouring grid cells a looser
+        # simhash distance counts when the layout and price band agree too.
+        if self.listing_id == other.listing_id:
+            return False
+        if self.address is not None and other.address is not None:
+            return self.address == other.address and (self.same_layout(other) or self.similar_body(other, max_distance))
+        if self.similar_body(other, max_distance):
+            return True
+        return self.near(other) and self.price_band == other.price_band and self.same_layout(other) and self.similar_body(other, cell_distance)
+
+    def similar_body(self, other, max_distance):
+        return self.body_hash is not None and other.body_hash is not None and hamming(self.body_hash, other.body_hash) <= max_distance
+
+def signed(value):
+    # SQLite integers are signed 64-bit
+    if value is not None and value >= 1 << 63:
+        return value - (1 << 64)
+    return value
+
+def unsigned(value):
+    if value is not None and value < 0:
+        return value + (1 << 64)
+    return value
@@ -0,0 +1,68 @@
+import math
+
+earth_radius_miles = 3958.8
+
+def haversine(latitude1, longitude1, latitude2, longitude2):
+    # Great-circle distance in miles
+    (phi1, phi2) = (math.radians(latitude1), math.radians(latitude2))
+    delta_phi = phi2 - phi1
+    delta_lambda = math.radians(longitude2 - longitude1)
+
+    a = math.sin(delta_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2) ** 2
+    return 2 * earth_radius_miles * math.asin(math.sqrt(a))
+
+def bounding_box(latitude, longitude, miles):
+    # (south, north, west, east) around a point; cheap to test and never smaller than the circle
+    delta_latitude = math.degrees(miles / earth_radius_miles)
+    delta_longitude = math.degrees(miles / (earth_radius_miles * max(math.cos(math.radians(latitude)), 1e-6)))
+    return (latitude - delta_latitude, latitude + delta_latitude, longitude - delta_longitude, longitude + delta_longitude)
+
+def parse_point(text):
+    # "37.39,-122.08" -> (37.39, -122.08), anything else -> None
+    try:
+        (latitude, longitude) = (float(part) for part in str(text).split(','))
+    except ValueError:
+        return None
+    return (latitude, longitude)
+
+def polygon_bounds(polygon):
+    latitudes = [point[0] for point in polygon]
+    longitudes = [point[1] for point in polygon]
+    return (min(latitudes), max(latitudes), min(longitudes), max(longitudes))
+
+def point_in_polygon(latitude, longitude, polygon):
+    # Ray casting over (lat, lon) vertices, the earth is flat enough at city scale
+    inside = False
+    previous = polygon[-1]
+    for point in polygon:
+        if (point[1] > longitude) != (previous[1] > longitude):
+            crossing = point[0] + (longitude - point[1]) * (previous[0] - point[0]) / (previous[1] - point[1])
+            if latitude < crossing:
+                inside = not inside
+        previous = point
+    return inside
+
+def in_bounds(latitude, longitude, bounds):
+    (south, north, west, east) = bounds
+    return south <= latitude <= north and west <= longitude <= east
+
+class SearchArea():
+
+    # Within `miles` of any center or inside any polygon. Bounding boxes are computed once,
+    # so most far away points are rejected without any trigonometry.
+    def __init__(self, centers=(), miles=None, polygons=()):
+        self.circles = [(center, bounding_box(center[0], center[1], miles)) for center in centers] if miles is not None else []
+        self.miles = miles
+        self.polygons = [(polygon, polygon_bounds(polygon)) for polygon in polygons if len(polygon) >= 3]
+
+    def __bool__(self):
+        return bool(self.circles or self.polygons)
+
+    def contains(self, latitude, longitude):
+        for (center, bounds) in self.circles:
+            if in_bounds(latitude, longitude, bounds) and haversine(center[0], center[1], latitude, longitude) <= self.miles:
+                return True
+        for (polygon, bounds) in self.polygons:
+            if in_bounds(latitude, longitude, bounds) and point_in_polygon(latitude, longitude, polygon):
+                return True
+        return False
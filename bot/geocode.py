@@ -0,0 +1,97 @@
+from bot.cache import SQLiteCache
+
+import threading
+import logging
+import time
+import re
+
+class GeocodeCache(SQLiteCache):
+
+    api_url = 'https://maps.googleapis.com/maps/api/geocode/json'
+
+    create_statement = """
+        CREATE TABLE IF NOT EXISTS geocodes (
+            address_key TEXT NOT NULL,
+            address TEXT NOT NULL,
+            latitude REAL NULL,
+            longitude REAL NULL,
+            created_at INTEGER NOT NULL,
+            UNIQUE (address_key)
+        );
+    """
+
+    # An address the API had no answer for is asked again after this many seconds
+    miss_max_age = 7 * 86400
+
+    def __init__(self, db_file, http=None, api_key=None):
+        self.http = http
+        self.api_key = api_key
+        self.entries = {}
+        self.lock = threading.Lock()
+
+        super().__init__(db_file)
+
+    def migrate(self, connection):
+        # Version 0 also stored empty entries while geocoding was off, drop them so they get geocoded
+        if connection.execute('PRAGMA user_version').fetchone()[0] < 1:
+            connection.execute('DELETE FROM geocodes WHERE latitude IS NULL')
+            connection.execute('PRAGMA user_version = 1')
+
+    def address_key(self, address):
+        return ' '.join(re.findall(r'[a-z0-9]+', address.lower()))
+
+    def lookup(self, address):
+        # Every spelling of an address resolves to the first answer we stored for it,
+        # with coordinates when the Geocoding API is enabled
+        address_key = self.address_key(address)
+        with self.lock:
+            if address_key in self.entries:
+                return self.entries[address_key]
+
+        entry = self.read(address_key)
+        if entry is not None and entry['latitude'] is None and (not self.can_geocode() or entry['created_at'] < time.time() - self.miss_max_age):
+            # Nothing is known yet when geocoding is off, and old misses are asked again
+            entry = None
+
+        if entry is None and self.can_geocode():
+            try:
+                entry = self.geocode(address) or {'address': address, 'latitude': None, 'longitude': None}
+                self.write(address_key, entry)
+            except Exception as e:
+                # Not stored, so the next run asks again
+                logging.warning(f'Geocoding failed for {address}: {e}')
+
+        # Without geocoding the address is used as is and nothing is stored
+        entry = entry or {'address': address, 'latitude': None, 'longitude': None}
+
+        with self.lock:
+            self.entries[address_key] = entry
+        return entry
+
+    def read(self, address_key):
+        select = 'SELECT address, latitude, longitude, created_at FROM geocodes WHERE address_key = ?'
+        with self.connect() as connection:
+            row = connection.execute(select, (address_key,)).fetchone()
+        return {'address': row[0], 'latitude': row[1], 'longitude': row[2], 'created_at': row[3]} if row else None
+
+    def write(self, address_key, entry):
+        insert = ''' INSERT OR REPLACE INTO geocodes (address_key, address, latitude, longitude, created_at) VALUES (?, ?, ?, ?, ?) '''
+        with self.connect() as connection:
+            connection.execute(insert, (address_key, entry['address'], entry['latitude'], entry['longitude'], int(time.time())))
+
+    def can_geocode(self):
+        return bool(self.http and self.api_key)
+
+    def geocode(self, address):
+        response = self.http.get(self.api_url, params={'address': address, 'key': self.api_key}, cache=False)
+        response.raise_for_status()
+        result = response.json()
+
+        if result.get('status') in ('OVER_QUERY_LIMIT', 'REQUEST_DENIED', 'UNKNOWN_ERROR'):
+            raise RuntimeError(result.get('error_message') or result.get('status'))
+        if result.get('status') != 'OK' or not result.get('results'):
+            logging.debug('No geocode for %s: %s', address, result.get('status'))
+            return None
+
+        location = result['results'][0]['geometry']['location']
+        return {'address': result['results'][0]['formatted_address'], 'latitude': round(location['lat'], 6), 'longitude': round(location['lng'], 6)}
@@ -0,0 +1,168 @@
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+from urllib.parse import urlsplit
+from bot.metrics import Metrics
+from bot.cache import SQLiteCache
+
+import threading
+import requests
+import hashlib
+import logging
+import json
+import time
+
+class ResponseCache(SQLiteCache):
+
+    create_statement = """
+        CREATE TABLE IF NOT EXISTS responses (
+            cache_key TEXT NOT NULL,
+            url TEXT NOT NULL,
+            status INTEGER NOT NULL,
+            headers TEXT NOT NULL,
+            content BLOB NOT NULL,
+            etag TEXT NULL,
+            last_modified TEXT NULL,
+            fetched_at INTEGER NOT NULL,
+            UNIQUE (cache_key)
+        );
+    """
+
+    journal_mode = 'WAL'
+
+    def read(self, cache_key):
+        select = 'SELECT url, status, headers, content, etag, last_modified, fetched_at FROM responses WHERE cache_key = ?'
+        with self.connect() as connection:
+            row = connection.execute(select, (cache_key,)).fetchone()
+
+        if row is None:
+            return None
+
+        (url, status, headers, content, etag, last_modified, fetched_at) = row
+        return {'url': url, 'status': status, 'headers': json.loads(headers), 'content': content, 'etag': etag, 'last_modified': last_modified, 'fetched_at': fetched_at}
+
+    def write(self, cache_key, response):
+        insert = ''' INSERT OR REPLACE INTO responses (cache_key, url, status, headers, content, etag, last_modified, fetched_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?) '''
+        headers = {key: value for (key, value) in response.headers.items() if key.lower() in ('content-type', 'etag', 'last-modified')}
+        with self.connect() as connection:
+            connection.execute(insert, (cache_key, response.url, response.status_code, json.dumps(headers), response.content,
+                response.headers.get('ETag'), response.headers.get('Last-Modified'), int(time.time())))
+
+    def touch(self, cache_key):
+        with self.connect() as connection:
+            connection.execute('UPDATE responses SET fetched_at = ? WHERE cache_key = ?', (int(time.time()), cache_key))
+
+    def purge(self, max_age):
+        with self.connect() as connection:
+            connection.execute('DELETE FROM responses WHERE fetched_at < ?', (int(time.time() - max_age),))
+
+class HttpClient():
+
+    user_agent = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.169 Safari/537.36'
+
+    def __init__(self, cache_file=None, timeout=(5, 30), retries=3, backoff=0.5, pool_size=10, metrics=None):
+        self.metrics = metrics or Metrics('http')
+        self.timeout = tuple(timeout) if isinstance(timeout, list) else timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.cache = ResponseCache(cache_file) if cache_file else None
+
+    def accept_encoding(self):
+        try:
+            import brotli
+            return 'gzip, deflate, br'
+        except ImportError:
+            return 'gzip, deflate'
+
+    def retry(self):
+        options = {'total': self.retries, 'backoff_factor': self.backoff, 'status_forcelist': (429, 500, 502, 503, 504), 'raise_on_status': False}
+        # urllib3 renamed method_whitelist to allowed_methods in 1.26, False retries every method
+        try:
+            return Retry(allowed_methods=False, **options)
+        except TypeError:
+            return Retry(method_whitelist=False, **options)
+
+    def session(self, url):
+        # One keep-alive session per host
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=self.retry())
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers.update({'User-Agent': self.user_agent, 'Accept-Encoding': self.accept_encoding()})
+                self.sessions[host] = session
+            return self.sessions[host]
+
+    def cache_key(self, method, url, params, data):
+        key = json.dumps([method, url, params, data if isinstance(data, (str, type(None))) else repr(data)], sort_keys=True, default=str)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def cached_response(self, entry):
+        response = requests.models.Response()
+        response.status_code = entry['status']
+        response.url = entry['url']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response._content = bytes(entry['content'])
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.from_cache = True
+        return response
+
+    def request(self, method, url, params=None, data=None, headers=None, max_age=None, cache=True, **kwargs):
+        # max_age: serve a stored copy younger than this without asking the server.
+        # Otherwise stored copies with an ETag / Last-Modified are revalidated with a conditional request.
+        headers = dict(headers or {})
+        kwargs.setdefault('timeout', self.timeout)
+
+        cache_key = None
+        entry = None
+        if self.cache and cache:
+            cache_key = self.cache_key(method, url, params, data)
+            entry = self.cache.read(cache_key)
+
+        if entry and max_age is not None and entry['fetched_at'] > time.time() - max_age:
+            logging.debug('HTTP cache hit: %s', url)
+            self.metrics.increment('http_cache_hits')
+            return self.cached_response(entry)
+
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        self.metrics.increment('http_requests')
+        with self.metrics.timer('http'):
+            response = self.session(url).request(method, url, params=params, data=data, headers=headers, **kwargs)
+        logging.debug('%s %s: %s', method, response.url, response.status_code)
+
+        if response.status_code == 429:
+            self.metrics.increment('http_rate_limited')
+        elif response.status_code >= 400:
+            self.metrics.increment('http_errors')
+
+        if entry and response.status_code == 304:
+            logging.debug('HTTP not modified: %s', url)
+            self.metrics.increment('http_not_modified')
+            self.cache.touch(cache_key)
+            return self.cached_response(entry)
+
+        response.from_cache = False
+        if cache_key and response.status_code == 200 and (max_age is not None or 'ETag' in response.headers or 'Last-Modified' in response.headers):
+            self.cache.write(cache_key, response)
+
+        return response
+
+    def get(self, url, params=None, **kwargs):
+        return self.request('GET', url, params=params, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request('POST', url, data=data, **kwargs)
+
+    def requests_get(self, *args, **kwargs):
+        # Drop-in for python-craigslist's requests_get(url, params=..., logger=...)
+        kwargs.pop('logger', None)
+        return self.get(*args, **kwargs)
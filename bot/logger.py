@@ -1,27 +1,75 @@
 import os
+import queue
+import atexit
+import threading
 import logging.handlers
 import logging
 
 class Logger():
 
-    def __init__(self, log_file, log_level):
+    # One handler per log file and logger for the whole process, however many bots ask for it
+    handlers = {}
+    lock = threading.Lock()
+    # Whoever set up logging first owns the root logger (the scheduler, or a bot run on its own)
+    unowned = object()
+    root_owner = unowned
+
+    def __init__(self, log_file, log_level, name=None, background=True, max_bytes=None, when=None, backup_count=5):
+        # max_bytes or when ('midnight', 'h', ...) rotate the file, otherwise it is reopened after an external logrotate
         self.log_file = log_file
         self.log_level = log_level
+        self.name = name
+        self.background = background
+        self.max_bytes = max_bytes
+        self.when = when
+        self.backup_count = backup_count
+        self.listener = None
 
         self.setup_logger()
 
     def setup_logger(self):
         log_path = os.path.dirname(self.log_file)
-        
+
         if not os.path.exists(log_path):
             os.makedirs(log_path)
 
-        handler = logging.handlers.WatchedFileHandler(self.log_file)
+        with self.lock:
+            if Logger.root_owner is Logger.unowned or Logger.root_owner == self.name:
+                # Everything goes to this file, shared modules (bot.http, bot.slack, ...) too
+                Logger.root_owner = self.name
+                logger = logging.getLogger()
+            else:
+                # Another bot or the scheduler owns the root logger: keep this bot's records in its own file only
+                logger = logging.getLogger(self.name)
+                logger.propagate = False
+            logger.setLevel(self.log_level)
+
+            key = (logger.name, os.path.realpath(self.log_file))
+            if key in self.handlers:
+                (handler, self.listener) = self.handlers[key]
+            else:
+                handler = self.file_handler()
+                if self.background:
+                    # The file is written from the listener's thread, callers only put records on a queue
+                    self.listener = logging.handlers.QueueListener(queue.SimpleQueue(), handler, respect_handler_level=True)
+                    handler = logging.handlers.QueueHandler(self.listener.queue)
+                    self.listener.start()
+                    atexit.register(self.listener.stop)
+
+                self.handlers[key] = (handler, self.listener)
+                logger.addHandler(handler)
+
+        self.logger = logger
+        logger.debug('Logging to file: %s', self.log_file)
+
+    def file_handler(self):
+        if self.max_bytes:
+            handler = logging.handlers.RotatingFileHandler(self.log_file, maxBytes=int(self.max_bytes), backupCount=self.backup_count)
+        elif self.when:
+            handler = logging.handlers.TimedRotatingFileHandler(self.log_file, when=self.when, backupCount=self.backup_count)
+        else:
+            handler = logging.handlers.WatchedFileHandler(self.log_file)
+
         formatter = logging.Formatter(fmt='[%(asctime)s - %(levelname)s]: %(message)s', datefmt='%Y-%m-%d %I:%M:%S %p %z %Z')
         handler.setFormatter(formatter)
-        
-        logger = logging.getLogger()
-        logger.setLevel(self.log_level)
-        logger.addHandler(handler)
-
-        logging.debug(f'Logging to file: {self.log_file}')
\ No newline at end of file
+        return handler
@@ -0,0 +1,58 @@
+from pytz import timezone
+from bot.cache import SQLiteCache
+
+import datetime
+import logging
+import json
+import time
+
+class MenuCache(SQLiteCache):
+
+    create_statement = """
+        CREATE TABLE IF NOT EXISTS menus (
+            cafe_id TEXT NOT NULL,
+            date TEXT NOT NULL,
+            meal TEXT NOT NULL,
+            items TEXT NOT NULL,
+            expires_at INTEGER NOT NULL,
+            UNIQUE (cafe_id, date, meal)
+        );
+    """
+
+    def __init__(self, db_file, offline=False):
+        self.offline = offline
+        self.timezone = timezone('US/Pacific')
+
+        super().__init__(db_file)
+
+    def expires_at(self, date):
+        # Menus are good until the next Pacific midnight
+        midnight = datetime.datetime.combine(date + datetime.timedelta(days=1), datetime.time())
+        return int(self.timezone.localize(midnight).timestamp())
+
+    def get_menu(self, cafe_id, date, meal, fetch):
+        items = self.read(cafe_id, date, meal)
+        if items is not None:
+            logging.debug('Menu cache hit for %s %s on %s', cafe_id, meal, date)
+            return items
+
+        if self.offline:
+            logging.warning(f'Offline and no cached menu for {cafe_id} {meal} on {date}')
+            return []
+
+        items = fetch()
+        self.write(cafe_id, date, meal, items)
+        return items
+
+    def read(self, cafe_id, date, meal):
+        select = 'SELECT items FROM menus WHERE cafe_id = ? AND date = ? AND meal = ? AND expires_at > ?'
+        with self.connect() as connection:
+            row = connection.execute(select, (str(cafe_id), date.isoformat(), meal, int(time.time()))).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def write(self, cafe_id, date, meal, items):
+        insert = ''' INSERT OR REPLACE INTO menus (cafe_id, date, meal, items, expires_at) VALUES (?, ?, ?, ?, ?) '''
+        with self.connect() as connection:
+            connection.execute('DELETE FROM menus WHERE expires_at <= ?', (int(time.time()),))
+            connection.execute(insert, (str(cafe_id), date.isoformat(), meal, json.dumps(items, separators=(',', ':')), self.expires_at(date)))
+        logging.debug('Cached %d menu items for %s %s on %s', len(items), cafe_id, meal, date)
@@ -0,0 +1,162 @@
+import contextlib
+import functools
+import threading
+import logging
+import bisect
+import time
+import os
+
+class Histogram():
+
+    # Seconds, from a cached SQLite lookup to a slow page fetch
+    default_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, buckets=None):
+        self.buckets = tuple(buckets or self.default_buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, fraction):
+        # Upper bound of the bucket holding the quantile
+        target = fraction * self.count
+        seen = 0
+        for (bound, count) in zip(self.buckets + (self.max,), self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {'count': self.count, 'sum': round(self.sum, 4), 'max': round(self.max, 4), 'p50': round(self.quantile(0.5), 4), 'p95': round(self.quantile(0.95), 4)}
+
+class Metrics():
+
+    # Counters and histograms for one bot. Totals live for the whole process (for Prometheus),
+    # the run view is reset by start_run() and summarized at the end of each run.
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.run_counters = {}
+        self.run_histograms = {}
+        self.run_started = None
+
+    def start_run(self):
+        with self.lock:
+            self.run_counters = {}
+            self.run_histograms = {}
+            self.run_started = time.time()
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            self.run_counters[name] = self.run_counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        with self.lock:
+            for histograms in (self.histograms, self.run_histograms):
+                if name not in histograms:
+                    histograms[name] = Histogram()
+                histograms[name].observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(f'{name}_seconds', time.perf_counter() - started)
+
+    def timed(self, name):
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def summary(self):
+        with self.lock:
+            return {
+                'bot': self.name,
+                'started': int(self.run_started or 0),
+                'counters': dict(sorted(self.run_counters.items())),
+                'timers': {name: histogram.summary() for (name, histogram) in sorted(self.run_histograms.items())},
+            }
+
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            for (name, value) in sorted(self.counters.items()):
+                metric = f'{self.name}_{name}_total'
+                lines += [f'# TYPE {metric} counter', f'{metric} {value}']
+
+            for (name, histogram) in sorted(self.histograms.items()):
+                metric = f'{self.name}_{name}'
+                lines.append(f'# TYPE {metric} histogram')
+                cumulative = 0
+                for (bound, count) in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+                lines += [f'{metric}_bucket{{le="+Inf"}} {histogram.count}', f'{metric}_sum {histogram.sum}', f'{metric}_count {histogram.count}']
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        # For node_exporter's textfile collector, which must never see a half written file
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as output:
+            output.write(self.prometheus())
+        os.replace(temporary, path)
+
+class MetricsServer():
+
+    def __init__(self, metrics, host='127.0.0.1', port=9100):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+
+                body = metrics.prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug('Metrics request: ' + format, *args)
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True)
+        self.thread.start()
+        logging.info(f'Serving metrics on http://{self.host}:{self.server.server_port}/metrics')
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
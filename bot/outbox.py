@@ -0,0 +1,42 @@
+import threading
+import logging
+
+class OutboxDrainer():
+
+    # Calls `deliver` on its own thread whenever notify() is called, and every
+    # `interval` seconds to retry what failed before
+    def __init__(self, deliver, interval=60, name='outbox'):
+        self.deliver = deliver
+        self.interval = interval
+        self.name = name
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+            self.thread.start()
+
+    def notify(self):
+        self.wakeup.set()
+
+    def run(self):
+        while not self.stopping.is_set():
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            if self.stopping.is_set():
+                break
+
+            try:
+                self.deliver()
+            except Exception as e:
+                logging.exception(f'Outbox delivery failed: {e}')
+
+    def stop(self, timeout=None):
+        if self.thread is not None:
+            self.stopping.set()
+            self.wakeup.set()
+            self.thread.join(timeout)
+            self.thread = None
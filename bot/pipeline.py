@@ -0,0 +1,135 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+from collections import deque
+from bot.metrics import Metrics
+
+import threading
+import logging
+import queue
+
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+class Stage():
+
+    def __init__(self, name, function, workers=1):
+        self.name = name
+        self.function = function
+        self.workers = max(1, int(workers))
+
+class Pipeline():
+
+    # Marks the end of a discovery source in its queue
+    finished = object()
+
+    def __init__(self, stages, max_pending=100, metrics=None):
+        self.stages = stages
+        self.max_pending = max_pending
+        self.metrics = metrics or Metrics('pipeline')
+        self.executors = []
+
+    def __enter__(self):
+        self.executors = [ThreadPoolExecutor(max_workers=stage.workers, thread_name_prefix=stage.name) for stage in self.stages]
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for executor in self.executors:
+            executor.shutdown(wait=True)
+        self.executors = []
+
+    def discover(self, sources, workers=1):
+        # Runs up to `workers` sources concurrently but yields their items in source order,
+        # so each source's own ordering (e.g. newest first) is kept.
+        queues = [queue.Queue(maxsize=self.max_pending) for _ in sources]
+        semaphore = threading.Semaphore(max(1, int(workers)))
+        threads = []
+
+        def produce(source, output):
+            try:
+                for item in source():
+                    output.put(item)
+            except Exception as e:
+                logging.exception(f'Discovery source failed: {e}')
+            finally:
+                output.put(self.finished)
+                semaphore.release()
+
+        def dispatch():
+            # Sources start in order as permits free up: the queue being read always has a running
+            # producer, while a later source can't hold a permit the earlier one is waiting for
+            for (source, output) in zip(sources, queues):
+                semaphore.acquire()
+                thread = threading.Thread(target=produce, args=(source, output), name='discovery', daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        dispatcher = threading.Thread(target=dispatch, name='discovery', daemon=True)
+        dispatcher.start()
+
+        for output in queues:
+            while True:
+                item = output.get()
+                if item is self.finished:
+                    break
+                yield item
+
+        dispatcher.join()
+        for thread in threads:
+            thread.join()
+
+    def run(self, items):
+        # Items flow through the stages concurrently, results come out in input order.
+        # A stage returning None drops the item.
+        pending = deque()
+
+        for item in items:
+            pending.append(self.submit(item))
+
+            while pending and (pending[0].done() or len(pending) >= self.max_pending):
+                result = self.result(pending.popleft())
+                if result is not None:
+                    yield result
+
+        while pending:
+            result = self.result(pending.popleft())
+            if result is not None:
+                yield result
+
+    def submit(self, item):
+        result = Future()
+        self.advance(0, item, result)
+        return result
+
+    def advance(self, index, item, result):
+        if item is None or index == len(self.stages):
+            result.set_result(item)
+            return
+
+        future = self.executors[index].submit(self.run_stage, self.stages[index], item)
+        future.add_done_callback(lambda done: self.finish_stage(done, index, result))
+
+    def run_stage(self, stage, item):
+        with self.metrics.timer(f'stage_{stage.name}'):
+            return stage.function(item)
+
+    def finish_stage(self, future, index, result):
+        error = future.exception()
+        if error:
+            result.set_exception(error)
+            return
+
+        self.advance(index + 1, future.result(), result)
+
+    def result(self, future):
+        try:
+            return future.result()
+        except Exception as e:
+            logging.exception(f'Pipeline item failed: {e}')
+            self.metrics.increment('pipeline_failed')
+            return None
@@ -0,0 +1,152 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import threading
+import datetime
+import logging
+import random
+import signal
+import time
+
+class CronExpression():
+
+    # minute, hour, day of month, month, day of week (0 or 7 = Sunday)
+    ranges = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f'Cron expression needs 5 fields: {expression}')
+
+        self.expression = expression
+        (self.minutes, self.hours, self.days, self.months, self.weekdays) = [self.parse_field(field, low, high) for (field, (low, high)) in zip(fields, self.ranges)]
+        self.weekdays = {weekday % 7 for weekday in self.weekdays}
+
+        # Like cron, when both day fields are restricted either one matching is enough
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def parse_field(self, field, low, high):
+        values = set()
+        for part in field.split(','):
+            (span, _, step) = part.partition('/')
+            step = int(step) if step else 1
+
+            if span == '*':
+                (start, end) = (low, high)
+            elif '-' in span:
+                (start, end) = map(int, span.split('-'))
+            else:
+                start = int(span)
+                end = high if step > 1 else start
+
+            if start < low or end > high or start > end or step < 1:
+                raise ValueError(f'Invalid cron field: {field}')
+            values.update(range(start, end + 1, step))
+        return values
+
+    def matches_day(self, date):
+        in_days = date.day in self.days
+        in_weekdays = (date.weekday() + 1) % 7 in self.weekdays
+
+        if self.any_day or self.any_weekday:
+            return in_days and in_weekdays
+        return in_days or in_weekdays
+
+    def next_time(self, after):
+        moment = after.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = moment + datetime.timedelta(days=366 * 4)
+
+        while moment < limit:
+            if moment.month not in self.months or not self.matches_day(moment):
+                moment = moment.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + datetime.timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += datetime.timedelta(minutes=1)
+            else:
+                return moment
+
+        raise ValueError(f'Cron expression never matches: {self.expression}')
+
+class Job():
+
+    def __init__(self, name, bot, interval=None, cron=None, jitter=0):
+        if (interval is None) == (cron is None):
+            raise ValueError(f'Job {name} needs exactly one of interval or cron')
+
+        self.name = name
+        self.bot = bot
+        self.interval = interval
+        self.cron = CronExpression(cron) if cron else None
+        self.jitter = jitter
+        self.lock = threading.Lock()
+        self.next_run = None
+
+    def schedule(self, now):
+        if self.cron:
+            next_run = self.cron.next_time(datetime.datetime.fromtimestamp(now)).timestamp()
+        else:
+            next_run = now + self.interval
+
+        # Spread bots sharing a schedule so they don't all hit the network at once
+        self.next_run = next_run + random.uniform(0, self.jitter)
+        logging.debug(f'Next run of {self.name} at {datetime.datetime.fromtimestamp(self.next_run)}')
+
+class Scheduler():
+
+    def __init__(self, max_workers=4):
+        self.jobs = []
+        self.stopping = threading.Event()
+        self.max_workers = max_workers
+
+    def add_job(self, name, bot, interval=None, cron=None, jitter=0, run_at_start=False):
+        job = Job(name, bot, interval=interval, cron=cron, jitter=jitter)
+        now = time.time()
+        if run_at_start:
+            job.next_run = now + random.uniform(0, jitter)
+        else:
+            job.schedule(now)
+        self.jobs.append(job)
+        return job
+
+    def stop(self, signum=None, frame=None):
+        logging.info(f'Stopping scheduler (signal: {signum})')
+        self.stopping.set()
+
+    def run_job(self, job):
+        # Skip the tick instead of piling up runs when the previous one is still going
+        if not job.lock.acquire(blocking=False):
+            logging.warning(f'Skipping {job.name}: previous run still in progress')
+            return
+
+        try:
+            started = time.time()
+            job.bot.execute()
+            logging.info(f'Finished {job.name} in {time.time() - started:.1f}s')
+        except (Exception, SystemExit) as e:
+            logging.exception(f'Job {job.name} failed: {e!r}')
+        finally:
+            job.lock.release()
+
+    def start(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        logging.info(f'Starting scheduler with {len(self.jobs)} jobs')
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job') as executor:
+            while not self.stopping.is_set() and self.jobs:
+                now = time.time()
+                for job in self.jobs:
+                    if job.next_run <= now:
+                        job.schedule(now)
+                        executor.submit(self.run_job, job)
+
+                next_run = min(job.next_run for job in self.jobs)
+                self.stopping.wait(max(0, next_run - time.time()))
+
+            logging.info('Waiting for running jobs to finish')
+
+        for job in self.jobs:
+            job.bot.shutdown()
+        logging.info('Scheduler stopped')
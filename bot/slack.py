@@ -1,10 +1,19 @@
-import slack
+from bot.metrics import Metrics
+
 import logging
+import hashlib
+import json
+import time
+import os
+
+class SlackChannelNotFound(Exception):
+    pass
 
 class Slack():
 
-    def __init__(self, token, channel, username, icon_url):
+    def __init__(self, token, channel, username, icon_url, cache_file=None, cache_ttl=86400, metrics=None):
         self.slack_client = None
+        self.metrics = metrics or Metrics('slack')
         self.slack_channel_id = None
 
         self.slack_token = token
@@ -12,41 +21,133 @@ class Slack():
         self.slack_username = username
         self.slack_icon_url = icon_url
 
+        self.cache_file = cache_file
+        self.cache_ttl = cache_ttl
+
         self.setup_client()
 
     def setup_client(self):
-        self.slack_client = slack.WebClient(token=self.slack_token)
-        self.find_slack_channel()
+        # A missing channel is fatal at startup only, later lookups raise to the caller
+        try:
+            self.find_slack_channel()
+        except SlackChannelNotFound as e:
+            logging.error(e)
+            exit(1)
 
-    def find_slack_channel(self):        
-        channels = self.slack_client.conversations_list(
-            types='public_channel,private_channel',
-            exclude_archived=1
-        )
+    def client(self):
+        # slackclient pulls in aiohttp, so only import it once we actually call Slack
+        if self.slack_client is None:
+            import slack
+            self.slack_client = slack.WebClient(token=self.slack_token)
+        return self.slack_client
 
-        channel_id = None
-        for channel in channels['channels']:
-            if channel['name'] and channel['name'] == self.slack_channel:
-                channel_id = channel['id']
+    def find_slack_channel(self):
+        channel_id = self.cached_channel_id()
 
         if channel_id is None:
-            logging.error(f'Could not find channel: {self.slack_channel} from channel list')
-            exit(1)
+            channel_id = self.lookup_channel_id()
+            if channel_id is not None:
+                self.cache_channel_id(channel_id)
+
+        if channel_id is None:
+            raise SlackChannelNotFound(f'Could not find channel: {self.slack_channel} from channel list')
 
         self.slack_channel_id = channel_id
         logging.debug(f'Found Slack channel ID for channel: {self.slack_channel} = {self.slack_channel_id}')
 
+    def lookup_channel_id(self):
+        cursor = None
+
+        while True:
+            params = {'types': 'public_channel,private_channel', 'exclude_archived': 1, 'limit': 1000}
+            if cursor:
+                params['cursor'] = cursor
+
+            channels = self.client().conversations_list(**params)
+            for channel in channels['channels']:
+                if channel['name'] and channel['name'] == self.slack_channel:
+                    return channel['id']
+
+            cursor = (channels.get('response_metadata') or {}).get('next_cursor')
+            if not cursor:
+                return None
+
+    def cache_key(self):
+        # Channel names are only unique within a workspace, so key on the token too
+        token_hash = hashlib.sha1(self.slack_token.encode('utf-8')).hexdigest()[:12]
+        return f'{token_hash}:{self.slack_channel}'
+
+    def read_cache(self):
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return {}
+
+        try:
+            with open(self.cache_file, 'r') as stream:
+                return json.load(stream)
+        except (OSError, ValueError) as e:
+            logging.warning(f'Ignoring unreadable Slack channel cache: {self.cache_file} ({e})')
+            return {}
+
+    def write_cache(self, cache):
+        if not self.cache_file:
+            return
+
+        temp_file = f'{self.cache_file}.tmp'
+        with open(temp_file, 'w') as stream:
+            json.dump(cache, stream)
+        os.replace(temp_file, self.cache_file)
+
+    def cached_channel_id(self):
+        entry = self.read_cache().get(self.cache_key())
+        if entry and entry['expires_at'] > time.time():
+            logging.debug(f'Using cached Slack channel ID for channel: {self.slack_channel}')
+            return entry['id']
+        return None
+
+    def cache_channel_id(self, channel_id):
+        cache = self.read_cache()
+        cache[self.cache_key()] = {'id': channel_id, 'expires_at': int(time.time() + self.cache_ttl)}
+        self.write_cache(cache)
+
+    def invalidate_channel_id(self):
+        cache = self.read_cache()
+        if cache.pop(self.cache_key(), None):
+            self.write_cache(cache)
+
     def send_message_to_channel(self, message=None, attachments=None, thread_ts=None):
-        post_message = self.slack_client.chat_postMessage(
-            text=message,
-            channel=self.slack_channel_id,
-            as_user=False,
-            unfurl_links=True,
-            username=self.slack_username,
-            icon_url=self.slack_icon_url,
-            thread_ts=thread_ts,
-            attachments=attachments
-        )
-
-        logging.debug(f'Slack message result: {post_message}')
-        return post_message
\ No newline at end of file
+        from slack.errors import SlackApiError
+
+        try:
+            return self.post_message(message, attachments, thread_ts)
+        except SlackApiError as e:
+            if e.response['error'] != 'channel_not_found':
+                raise
+
+            # The cached ID went stale (channel renamed or recreated), look it up again
+            logging.warning(f'Slack channel ID for {self.slack_channel} not found, refreshing')
+            self.invalidate_channel_id()
+            self.find_slack_channel()
+            return self.post_message(message, attachments, thread_ts)
+
+    def post_message(self, message=None, attachments=None, thread_ts=None):
+        from slack.errors import SlackApiError
+
+        self.metrics.increment('slack_calls')
+        try:
+            with self.metrics.timer('slack'):
+                post_message = self.client().chat_postMessage(
+                    text=message,
+                    channel=self.slack_channel_id,
+                    as_user=False,
+                    unfurl_links=True,
+                    username=self.slack_username,
+                    icon_url=self.slack_icon_url,
+                    thread_ts=thread_ts,
+                    attachments=attachments
+                )
+        except SlackApiError as e:
+            self.metrics.increment('slack_rate_limited' if e.response.status_code == 429 else 'slack_errors')
+            raise
+
+        logging.debug('Slack message result: %s', post_message)
+        return post_message
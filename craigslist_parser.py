@@ -0,0 +1,202 @@
+from bot.dates import parse_date
+from enum import IntEnum
+
+import urllib.parse as urlparse
+
+# Detail page parsing, kept apart from python-craigslist so it can run without the network
+class CraigslistDetailParser():
+
+    tags = IntEnum('tags', 'rooms sqfeet availability', start=0)
+    posting = IntEnum('posting', 'postedtop postedbottom updated', start=0)
+
+    # 'bs4' builds a BeautifulSoup tree and runs the parse_* selectors,
+    # 'lxml' extracts every field in one streaming pass
+    engine = 'bs4'
+
+    def parse_content(self, result, content):
+        if self.engine == 'lxml':
+            return self.extract(result, content)
+
+        detail_soup = self.build_soup(content)
+        self.customize(result, detail_soup)
+        self.geotag_result(result, detail_soup)
+        return result
+
+    def build_soup(self, content):
+        from bs4 import BeautifulSoup
+        return BeautifulSoup(content, 'html.parser')
+
+    def remove_prefix(self, text, prefix):
+        if text.startswith(prefix):
+            return text[len(prefix):]
+        return text
+
+    def customize(self, result, detail_soup):
+        self.parse_rooms_and_availability(result, detail_soup)
+        self.parse_dates_and_times(result, detail_soup)
+        self.parse_images(result, detail_soup)
+        self.parse_body(result, detail_soup)
+        self.parse_address(result, detail_soup)
+        self.parse_data_accuracy(result, detail_soup)
+        result['provider'] = 'Craigslist'
+
+    def parse_rooms_and_availability(self, result, detail_soup):
+        result.update({'rooms': None, 'bathrooms': None, 'availability': None})
+        housing_info = detail_soup.select('span.shared-line-bubble')
+        for (index, element) in enumerate(housing_info):
+            text = element.text.strip()
+            if index == self.tags.rooms.value:
+                rooms = text.split('/')
+                result['bedrooms'] = rooms[0].strip()[:-2]
+                result['bathrooms'] = rooms[1].strip()[:-2]
+                result['rooms'] = text
+            if index == self.tags.sqfeet.value:
+                result['area'] = text
+            if index == self.tags.availability.value:
+                datetime = element['data-date']
+                date = parse_date(datetime)
+                result['availability'] = date
+
+    def parse_dates_and_times(self, result, detail_soup):
+        result.update({'posted': None, 'updated': None})
+        posting_info = detail_soup.select('p.postinginfo.reveal')
+        for (index, element) in enumerate(posting_info):
+            time = element.select('time')[0]
+            datetime = time['datetime']
+            date = parse_date(datetime)
+            if index == self.posting.postedbottom.value:
+                result['posted'] = date
+            if index == self.posting.updated.value:
+                result['updated'] = date
+
+    def parse_images(self, result, detail_soup):
+        result.update({'image': None})
+        image_info = detail_soup.select('div.swipe-wrap')
+        if image_info:
+            image_info = image_info[0]
+            first_image = image_info.select('img')[0]
+            result['image'] = first_image['src']
+
+    def parse_body(self, result, detail_soup):
+        result['body'] = self.remove_prefix(detail_soup.select('#postingbody')[0].text.strip(), 'QR Code Link to This Post').strip()
+
+    def parse_address(self, result, detail_soup):
+        result.update({'gaddress': None, 'gcoords': None})
+        lat_long_address = detail_soup.select('p.mapaddress')
+        if lat_long_address:
+            map_link = lat_long_address[0].select('a')[0]
+            self.parse_gmaps_link(result, map_link['href'])
+
+    def parse_data_accuracy(self, result, detail_soup):
+        map = detail_soup.find('div', {'id': 'map'})
+        if map:
+            result['map_accuracy'] = int(map.attrs['data-accuracy'])
+
+    def parse_gmaps_link(self, result, link):
+        last_slash = link.rfind('/')
+        remaining = link[last_slash+1:]
+
+        if '?' in remaining:
+            parsedurl = urlparse.urlparse(link)
+            query = urlparse.parse_qs(parsedurl.query)
+            result['gaddress'] = query['q'][0]
+        else:
+            components = remaining.split(',')
+            result['gcoords'] = {
+                'lat': components[0][1:],
+                'long': components[1]
+            }
+
+    def geotag_result(self, result, detail_soup):
+        map = detail_soup.find('div', {'id': 'map'})
+        if map:
+            result['geotag'] = (float(map.attrs['data-latitude']), float(map.attrs['data-longitude']))
+        return result
+
+    def extract(self, result, content):
+        from lxml import etree
+
+        result.update({'rooms': None, 'bathrooms': None, 'availability': None, 'posted': None, 'updated': None, 'image': None, 'gaddress': None, 'gcoords': None})
+        bubbles = []
+        postings = []
+        body = None
+        map_link = None
+
+        # Elements we need text or descendants from stay in the tree until their end event,
+        # everything else is cleared as soon as it closes to keep memory flat
+        keep = 0
+        pull_parser = etree.HTMLPullParser(events=('start', 'end'))
+
+        for (event, element) in self.stream_events(pull_parser, content):
+            if not isinstance(element.tag, str):
+                continue
+
+            tag = element.tag
+            classes = (element.get('class') or '').split()
+            is_kept = (tag == 'span' and 'shared-line-bubble' in classes) or (tag == 'p' and ('postinginfo' in classes and 'reveal' in classes or 'mapaddress' in classes)) \
+                or (tag == 'div' and 'swipe-wrap' in classes) or (tag == 'section' and element.get('id') == 'postingbody')
+
+            if event == 'start':
+                if is_kept:
+                    keep += 1
+                elif tag == 'div' and element.get('id') == 'map':
+                    if element.get('data-accuracy') is not None:
+                        result['map_accuracy'] = int(element.get('data-accuracy'))
+                    if element.get('data-latitude') is not None:
+                        result['geotag'] = (float(element.get('data-latitude')), float(element.get('data-longitude')))
+                continue
+
+            if is_kept:
+                keep -= 1
+                if tag == 'span':
+                    bubbles.append((self.element_text(element).strip(), element.get('data-date')))
+                elif 'reveal' in classes:
+                    times = element.findall('.//time')
+                    postings.append(times[0].get('datetime') if times else None)
+                elif tag == 'p' and map_link is None:
+                    links = element.findall('.//a')
+                    map_link = links[0].get('href') if links else None
+                elif tag == 'div' and result['image'] is None:
+                    images = element.findall('.//img')
+                    result['image'] = images[0].get('src') if images else None
+                elif tag == 'section' and body is None:
+                    body = self.element_text(element)
+
+            if keep == 0:
+                element.clear()
+
+        for (index, (text, date)) in enumerate(bubbles):
+            if index == self.tags.rooms.value:
+                rooms = text.split('/')
+                result['bedrooms'] = rooms[0].strip()[:-2]
+                result['bathrooms'] = rooms[1].strip()[:-2]
+                result['rooms'] = text
+            if index == self.tags.sqfeet.value:
+                result['area'] = text
+            if index == self.tags.availability.value:
+                result['availability'] = parse_date(date)
+
+        for (index, datetime) in enumerate(postings):
+            if index == self.posting.postedbottom.value:
+                result['posted'] = parse_date(datetime)
+            if index == self.posting.updated.value:
+                result['updated'] = parse_date(datetime)
+
+        result['body'] = self.remove_prefix(body.strip(), 'QR Code Link to This Post').strip()
+
+        if map_link:
+            self.parse_gmaps_link(result, map_link)
+
+        result['provider'] = 'Craigslist'
+        return result
+
+    def stream_events(self, pull_parser, content, chunk_size=16384):
+        for start in range(0, len(content), chunk_size):
+            pull_parser.feed(content[start:start + chunk_size])
+            yield from pull_parser.read_events()
+        pull_parser.close()
+        yield from pull_parser.read_events()
+
+    def element_text(self, element):
+        # Collapse whitespace-only strings the way BeautifulSoup does, so both engines return the same text
+        return ''.join(('\n' if '\n' in text else ' ') if text.isspace() else text for text in element.itertext())
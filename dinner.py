@@ -1,10 +1,9 @@
-from bs4 import BeautifulSoup
 from enum import IntEnum
 from bot.bot import Bot
+from bot.menu_cache import MenuCache
 from pytz import timezone
 
 from dinner_client import CafeClient
-import requests
 import datetime
 import os
 import click
@@ -12,12 +11,15 @@ import sqlite3
 import traceback
 import logging
 
+logger = logging.getLogger('dinner')
+
 class DinnerBot(Bot):
 
     weekdays = IntEnum('weekdays', 'monday tuesday wednesday thursday friday saturday sunday', start=0)
 
-    def __init__(self, log_file=None, log_level=None, config_file=None):
-        super().__init__(log_file, log_level, config_file)
+    def __init__(self, log_file=None, log_level=None, config_file=None, autorun=True, offline=False):
+        self.menu_cache = MenuCache(db_file=os.path.dirname(os.path.realpath(__file__)) + '/menus.db', offline=offline)
+        super().__init__(log_file, log_level, config_file, autorun)
 
     def filename(self):
         return os.path.splitext(os.path.basename(__file__))[0]
@@ -33,22 +35,22 @@ class DinnerBot(Bot):
     def fetch_dinner_menu_for_today(self):
         date = self.today_date()
         
-        logging.info(f'Fetching dinner menu for {date}: started')
+        logger.info(f'Fetching dinner menu for {date}: started')
 
         if date.weekday() >= self.weekdays.friday.value:
-            logging.info('Not Mon-Thurs, not scraping')
-            exit(0)
+            logger.info('Not Mon-Thurs, not scraping')
+            return
 
         self.fetch_menu(date)
 
-        logging.info(f'Fetching dinner menu for {date}: completed')
+        logger.info(f'Fetching dinner menu for {date}: completed')
 
 
     def fetch_menu(self, date):
         MEZZOS = '1623'
-        cafe = CafeClient(MEZZOS)
+        menu_items = self.menu_cache.get_menu(MEZZOS, date, 'dinner', lambda: CafeClient(MEZZOS).get_dinner())
 
-        message = self.format_menu_items(cafe.get_dinner())
+        message = self.format_menu_items(menu_items)
         self.slack.send_message_to_channel(message)
     
     def format_menu_items(self, menu_items):
@@ -71,9 +73,10 @@ class DinnerBot(Bot):
 
 @click.command()
 @click.option('--log-level', default='INFO')
+@click.option('--offline/--online', default=False, help='Only serve menus from the local cache')
 
-def main(log_level):
-    dinner_bot = DinnerBot(log_level=log_level)
+def main(log_level, offline):
+    dinner_bot = DinnerBot(log_level=log_level, offline=offline)
 
 if __name__ == '__main__':
     main()
@@ -1,16 +1,22 @@
-from bs4 import BeautifulSoup
 from enum import IntEnum
 from pytz import timezone
 from bot.bot import Bot
+from bot.menu_cache import MenuCache
+from bot.digest import Digest
 from dinner_client import CafeClient
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
+import itertools
+import functools
 import datetime
+import re
 import os
 import traceback
 import logging
 import click
 
+logger = logging.getLogger('food_search')
+
 # Constants
 C950 = "1544" 
 JOURNEY_MARKETPLACE = C950 
@@ -40,15 +46,35 @@ class FoodBot(Bot):
 
     weekdays = IntEnum('weekdays', 'monday tuesday wednesday thursday friday saturday sunday', start=0)
 
-    def __init__(self, log_file=None, log_level=None, config_file=None):
+    default_meals = ['breakfast', 'lunch', 'dinner']
+
+    def __init__(self, log_file=None, log_level=None, config_file=None, autorun=True, offline=False):
         self.food_searches = None
-        super().__init__(log_file, log_level, config_file)
+        self.food_pattern = None
+        self.meals = None
+        self.digest = None
+        self.menu_cache = MenuCache(db_file=os.path.dirname(os.path.realpath(__file__)) + '/menus.db', offline=offline)
+        super().__init__(log_file, log_level, config_file, autorun)
 
     def filename(self):
         return os.path.splitext(os.path.basename(__file__))[0]
 
     def config_setup(self, config):
         self.food_searches = list(map(lambda item: item.lower(), config['search']))
+        # Only meals the cafe client has a getter for, DinnerBot relies on get_dinner()
+        meals = config.get('meals', self.default_meals)
+        self.meals = [meal for meal in meals if hasattr(CafeClient, f'get_{meal}')]
+        for meal in meals:
+            if meal not in self.meals:
+                logger.warning(f'Skipping {meal}: the cafe client has no get_{meal}()')
+
+        digest = {'enabled': False, 'threshold': 50, 'window': None, 'per_message': 20, 'max_size': 3500, **(config.get('digest') or {})}
+        if digest.pop('enabled'):
+            self.digest = Digest(self.send_digest, **digest)
+
+        # Longest terms first so overlapping terms report the most specific match
+        terms = sorted(set(self.food_searches), key=len, reverse=True)
+        self.food_pattern = re.compile('|'.join(map(re.escape, terms)))
         return self.food_searches
 
     def run(self):
@@ -59,40 +85,87 @@ class FoodBot(Bot):
         date = datetime.datetime.now(tz=tz)
         date = date.date()
         
-        logging.info(f'Fetching menu for {date}: started')
+        logger.info(f'Fetching menu for {date}: started')
 
         if date.weekday() > self.weekdays.friday.value:
-            logging.info('Weekend, not scraping')
-            exit(0)
+            logger.info('Weekend, not scraping')
+            return
+
+        with ThreadPoolExecutor(max_workers=len(SOUTH_BAY_CAFES)) as executor:
+            menus = executor.map(self.metrics.timed('menu_fetch')(self.fetch_menu), SOUTH_BAY_CAFES.values(), itertools.repeat(date))
+
+            # Posts stay in cafe order while the other menus are still loading
+            for (cafe, items) in zip(SOUTH_BAY_CAFES.keys(), menus):
+                self.notify_matches(cafe, self.match_items(items), date)
 
-        for (cafe, cafe_id) in SOUTH_BAY_CAFES.items():
-            self.fetch_menu(cafe, cafe_id, date)
+        if self.digest:
+            self.digest.flush()
         
-        logging.info(f'Fetching menu for {date}: completed')
+        logger.info(f'Fetching menu for {date}: completed')
     
-    def fetch_menu(self, cafe, cafe_id, date):
-        cafe_client = CafeClient(cafe_id)
+    def fetch_menu(self, cafe_id, date):
+        cafe_client = None
 
-        items = []
-        for food in self.food_searches:
-            find = cafe_client.find(food)
-            if len(find) > 0:
-                items += find
+        def fetch(meal):
+            nonlocal cafe_client
+            if cafe_client is None:
+                cafe_client = CafeClient(cafe_id)
+            return getattr(cafe_client, f'get_{meal}')()
 
+        # One cafe failing to load still lets the others post
+        items = []
+        try:
+            for meal in self.meals:
+                for item in self.menu_cache.get_menu(cafe_id, date, meal, functools.partial(fetch, meal)):
+                    items.append({'meal': meal, **item})
+        except Exception as e:
+            logger.error(f'Failed to fetch menu for {cafe_id}: {e!r}')
+            self.metrics.increment('menu_fetch_failed')
+        return items
+
+    def match_items(self, items):
+        matches = []
         for item in items:
-            message = self.format_found_message(cafe, item, date)
+            found = self.food_pattern.findall(item['label'].lower())
+            if found:
+                matches.append((item, found))
+        self.metrics.increment('menu_items', len(items))
+        self.metrics.increment('menu_matches', len(matches))
+        return matches
+
+    def notify_matches(self, cafe, matches, date):
+        if not matches:
+            return
+
+        message = self.format_found_message(cafe, matches, date)
+        if self.digest:
+            self.digest.add(message)
+        elif self.slack_queue:
+            self.slack_queue.send_message_to_channel(message)
+        else:
+            self.slack.send_message_to_channel(message)
+
+    def send_digest(self, messages, index, total):
+        # All cafes in as few posts as Slack's message size allows
+        message = '\n'.join(messages)
+        if self.slack_queue:
+            self.slack_queue.send_message_to_channel(message)
+        else:
             self.slack.send_message_to_channel(message)
 
-    def format_found_message(self, cafe, item, date):
+    def format_found_message(self, cafe, matches, date):
         date_text = date.strftime('%A, %Y-%m-%d')
-        message = f'Found *{item["label"].lower()}* for {item["meal"].lower()} at {cafe} on {date_text}'
+        message = f'Found at {cafe} on {date_text}:\n'
+        for (item, found) in matches:
+            message += f' - *{item["label"].lower()}* for {item["meal"].lower()} ({", ".join(sorted(set(found)))})\n'
         return message
 
 @click.command()
 @click.option('--log-level', default='INFO')
+@click.option('--offline/--online', default=False, help='Only serve menus from the local cache')
 
-def main(log_level):
-    food_bot = FoodBot(log_level=log_level)
+def main(log_level, offline):
+    food_bot = FoodBot(log_level=log_level, offline=offline)
 
 if __name__ == '__main__':
     main()
@@ -1,11 +1,14 @@
-from craigslist import CraigslistHousing, requests_get, bs, RESULTS_PER_REQUEST, CraigslistBase
-from urllib.parse import urljoin
-
 from bot.bot import Bot
+from bot.pipeline import Pipeline, Stage
+from bot.bloom import BloomFilter
+from bot.fingerprint import Fingerprint, parse_price, parse_rooms, parse_area, listing_coordinates
+from bot.geo import haversine, bounding_box, SearchArea
+from bot.digest import Digest
+from bot.outbox import OutboxDrainer
+from bot.dates import parse_date
+from housing_scoring import ListingScores
+from concurrent.futures import ThreadPoolExecutor
 from sqlite3 import Error
-from dateutil import parser
-from enum import IntEnum
-from motionless import DecoratedMap, AddressMarker, LatLonMarker, Color
 from pytz import timezone
 
 import logging
@@ -15,352 +18,566 @@ import click
 import time
 import os
 import json
-import math
-import requests
-import urllib.parse as urlparse
-import dateparser
-
-# Override to use https
-CraigslistBase.url_templates = url_templates = {
-    'base': 'https://%(site)s.craigslist.org',
-    'no_area': 'https://%(site)s.craigslist.org/search/%(category)s',
-    'area': 'https://%(site)s.craigslist.org/search/%(area)s/%(category)s'
-}
-
-class CraigslistHousingCustom(CraigslistHousing):
-
-    tags = IntEnum('tags', 'rooms sqfeet availability', start=0)
-    posting = IntEnum('posting', 'postedtop postedbottom updated', start=0)
-
-    def remove_prefix(self, text, prefix):
-        if text.startswith(prefix):
-            return text[len(prefix):]
-        return text
-
-    def customize(self, result, detail_soup):
-        self.parse_rooms_and_availability(result, detail_soup)
-        self.parse_dates_and_times(result, detail_soup)
-        self.parse_images(result, detail_soup)
-        self.parse_body(result, detail_soup)
-        self.parse_address(result, detail_soup)
-        self.parse_data_accuracy(result, detail_soup)
-        result['provider'] = 'Craigslist'
-
-    def parse_rooms_and_availability(self, result, detail_soup):
-        result.update({'rooms': None, 'bathrooms': None, 'availability': None})
-        housing_info = detail_soup.select('span.shared-line-bubble')
-        for (index, element) in enumerate(housing_info):
-            text = element.text.strip()
-            if index == self.tags.rooms.value:
-                rooms = text.split('/')
-                result['bedrooms'] = rooms[0].strip()[:-2]
-                result['bathrooms'] = rooms[1].strip()[:-2]
-                result['rooms'] = text
-            if index == self.tags.sqfeet.value:
-                result['area'] = text
-            if index == self.tags.availability.value:
-                datetime = element['data-date']
-                date = parser.parse(datetime)
-                result['availability'] = date
-
-    def parse_dates_and_times(self, result, detail_soup):
-        result.update({'posted': None, 'updated': None})
-        posting_info = detail_soup.select('p.postinginfo.reveal')
-        for (index, element) in enumerate(posting_info):
-            time = element.select('time')[0]
-            datetime = time['datetime']
-            date = parser.parse(datetime)
-            if index == self.posting.postedbottom.value:
-                result['posted'] = date
-            if index == self.posting.updated.value:
-                result['updated'] = date
-
-    def parse_images(self, result, detail_soup):
-        result.update({'image': None})
-        image_info = detail_soup.select('div.swipe-wrap')
-        if image_info:
-            image_info = image_info[0]
-            first_image = image_info.select('img')[0]
-            result['image'] = first_image['src']
-
-    def parse_body(self, result, detail_soup):
-        result['body'] = self.remove_prefix(detail_soup.select('#postingbody')[0].text.strip(), 'QR Code Link to This Post').strip()
-
-    def parse_address(self, result, detail_soup):
-        result.update({'gaddress': None, 'gcoords': None})
-        lat_long_address = detail_soup.select('p.mapaddress')
-        if lat_long_address:
-            map_link = lat_long_address[0].select('a')[0]
-            self.parse_gmaps_link(result, map_link['href'])
-
-    def parse_data_accuracy(self, result, detail_soup):
-        map = detail_soup.find('div', {'id': 'map'})
-        if map:
-            result['map_accuracy'] = int(map.attrs['data-accuracy'])
-
-    def parse_gmaps_link(self, result, link):
-        last_slash = link.rfind('/')
-        remaining = link[last_slash+1:]
-
-        if '?' in remaining:
-            parsedurl = urlparse.urlparse(link)
-            query = urlparse.parse_qs(parsedurl.query)
-            result['gaddress'] = query['q'][0]
-        else:
-            components = remaining.split(',')
-            result['gcoords'] = {
-                'lat': components[0][1:],
-                'long': components[1]
-            }
+import functools
+import importlib
+import threading
 
-class HousingBot(Bot):
+logger = logging.getLogger('housing')
 
-    searches = [
-        {
-            'min_price': 2500,
-            'max_price': 6000,
-            'housing_type': ['house'],
-            'min_bedrooms': 4,
-            'max_bedrooms': 4,
-            'min_bathrooms': 3,
-            'max_bathrooms': 4,
-            'has_image': True,
-            'bundle_duplicates': True,
-            'zip_code': 94089,
-            'search_distance': 10
-        },
-    ]
+class HousingBot(Bot):
 
-    def __init__(self, notify, db_file=None, log_file=None, log_level=None, config_file=None):
+    default_providers = {
+        'craigslist': {'module': 'housing_craigslist', 'class': 'CraigslistProvider'},
+        'zillow': {'module': 'housing_zillow', 'class': 'ZillowProvider'},
+    }
+
+    # Used when housing.yaml has no `searches`, as before they moved there
+    default_searches = {
+        'craigslist': [{
+            'site': 'sfbay',
+            'area': 'sby',
+            'category': 'apa',
+            'filters': {
+                'min_price': 2500,
+                'max_price': 6000,
+                'housing_type': ['house'],
+                'min_bedrooms': 4,
+                'max_bedrooms': 4,
+                'min_bathrooms': 3,
+                'max_bathrooms': 4,
+                'has_image': True,
+                'bundle_duplicates': True,
+                'zip_code': 94089,
+                'search_distance': 10
+            },
+        }],
+        'zillow': [
+            '{"mapBounds":{"west":-122.20709478930667,"east":-121.88780462817385,"south":37.27609897350297,"north":37.471449369286226},"usersSearchTerm":"Mountain View CA","isMapVisible":true,"mapZoom":12,"filterState":{"price":{"min":0,"max":1584322},"monthlyPayment":{"min":0,"max":6000},"beds":{"min":4,"max":4},"baths":{"min":3},"sortSelection":{"value":"days"},"isForSaleByAgent":{"value":false},"isForSaleByOwner":{"value":false},"isNewConstruction":{"value":false},"isForSaleForeclosure":{"value":false},"isComingSoon":{"value":false},"isAuction":{"value":false},"isPreMarketForeclosure":{"value":false},"isPreMarketPreForeclosure":{"value":false},"isMakeMeMove":{"value":false},"isForRent":{"value":true},"isCondo":{"value":false},"isMultiFamily":{"value":false}},"isListVisible":true,"customRegionId":"96bc65cef7X1-CR1ibhyilzdzibi_vx0sv"}'
+        ],
+    }
+
+    colors = {
+        'unknown': '#FFFFFF',
+        'green': '#008000',
+        'orange': '#FFA500',
+        'red': '#FF0000',
+    }
+
+    color_names = {
+        'unknown': '?',
+        'green': '$',
+        'orange': '$$',
+        'red': '$$$',
+    }
+
+    # craigslist_date of listings without a date of their own
+    placeholder_insert_time = 1559197920
+
+    default_workers = {
+        'discovery': 4,
+        'details': 8,
+        'notify': 4,
+    }
+
+    def __init__(self, notify, db_file=None, log_file=None, log_level=None, config_file=None, autorun=True, requeue_outbox=False):
         if not db_file:
             db_file = os.path.dirname(os.path.realpath(__file__)) + '/' + self.filename() + '.db'
 
         self.db = SQL(db_file=db_file)
+        self.seen_filter = None
         self.notify = notify
+        self.requeue_outbox = requeue_outbox
         self.timezone = timezone('US/Pacific')
 
         self.google_api_key = None
         self.map_markers = None
+        self.maps_config = None
+        self.static_markers = None
+        self.map_url = None
+        self.geocodes = None
+        self.geo_filter = None
+        self.search_area = None
         self.template = None
-
-        super().__init__(log_file, log_level, config_file)
+        self.workers = None
+        self.http = None
+        self.http_config = None
+        self.detail_parser = None
+        self.incremental = None
+        self.duplicates = None
+        self.digest = None
+        self.outbox = None
+        self.drainer = None
+        self.outbox_lock = threading.Lock()
+        self.searches = None
+        self.provider_modules = None
+        self.providers = {}
+
+        super().__init__(log_file, log_level, config_file, autorun)
 
     def config_setup(self, config):
         self.google_api_key = config['google_api_key']
         self.map_markers = config['map_markers']
         self.template = config['template'].rstrip('\n').lstrip('\n')
+        self.workers = {**self.default_workers, **(config.get('pipeline') or {})}
+        self.detail_parser = config.get('detail_parser', 'bs4')
+        self.setup_http(config.get('http') or {})
+        self.setup_maps(config.get('maps') or {})
+
+        # searches: {provider name: [search, ...]}, providers: {provider name: {module, class}}
+        if 'searches' in config:
+            self.searches = config['searches'] or {}
+            if not any(self.searches.values()):
+                logger.error('No housing searches in config, add some under `searches`')
+                return False
+        else:
+            logger.warning('No `searches` in config, using the default Craigslist and Zillow searches')
+            self.searches = self.default_searches
+        self.provider_modules = dict(self.default_providers)
+        for (name, provider) in (config.get('providers') or {}).items():
+            self.provider_modules[name] = {**self.provider_modules.get(name, {}), **provider}
+        unknown = [name for name in self.searches if name not in self.provider_modules]
+        if unknown:
+            logger.error(f'No provider for searches: {", ".join(unknown)}')
+            return False
+
+        self.incremental = {'enabled': True, 'stop_after': 20, **(config.get('incremental') or {})}
+        self.duplicates = {'enabled': True, 'cell_size': 0.001, 'price_band': 250, 'max_distance': 3, 'cell_distance': 18, 'max_age_days': 30, **(config.get('duplicates') or {})}
+
+        # Listings placed outside the search area are stored as seen without fetching their detail page
+        self.geo_filter = {'enabled': False, 'max_miles': None, 'polygons': [], 'use_where': False, **(config.get('geo_filter') or {})}
+
+        # Notifications are written to the outbox table with their listing and sent from the drainer thread
+        self.outbox = {'enabled': True, 'batch_size': 20, 'interval': 60, 'max_attempts': 10, 'backoff': 30, 'max_backoff': 3600, **(config.get('outbox') or {})}
+        if self.outbox['enabled'] and self.notify:
+            self.drainer = OutboxDrainer(self.deliver_outbox, interval=self.outbox['interval'])
+
+        digest = {'enabled': False, 'threshold': 50, 'window': 300, 'per_message': 10, 'max_size': 16000, **(config.get('digest') or {})}
+        if digest.pop('enabled'):
+            self.digest = Digest(self.send_digest, **digest)
+
+        database = config.get('database') or {}
+        self.db.journal_mode = database.get('journal_mode', self.db.journal_mode)
+        self.db.synchronous = database.get('synchronous', self.db.synchronous)
+        if database.get('seen_filter', True):
+            self.seen_filter = {
+                'file': database.get('seen_filter_file', f'{self.db.db_file}.bloom'),
+                'capacity': database.get('seen_filter_capacity', 100000),
+                'error_rate': database.get('seen_filter_error_rate', 0.001),
+            }
         return self.google_api_key
 
+    def setup_http(self, http_config):
+        from bot.http import HttpClient
+
+        self.http_config = {'timeout': [5, 30], 'retries': 3, 'backoff': 0.5, 'cache': True, 'detail_max_age': 7 * 86400, 'cache_max_age': 14 * 86400, **http_config}
+        cache_file = os.path.splitext(self.db.db_file)[0] + '.http.db' if self.http_config['cache'] else None
+        self.http = HttpClient(cache_file=cache_file, timeout=self.http_config['timeout'], retries=self.http_config['retries'], backoff=self.http_config['backoff'], pool_size=self.workers['details'], metrics=self.metrics)
+
     def filename(self):
         return os.path.splitext(os.path.basename(__file__))[0]
 
     def run(self):
-        self.db.open()
-        self.db.create_table()
-        self.fetch_housing()
-        self.db.close()
-
-    def fetch_housing(self):
-        logging.info('Fetching craigslist housing')
+        # The connection and seen filter stay open between runs when scheduled
+        if self.http.cache:
+            self.http.cache.purge(self.http_config['cache_max_age'])
 
-        for search in self.searches:
-            housing_query = CraigslistHousingCustom(site='sfbay', area='sby', category='apa', filters=search, log_level=logging.INFO)
+        if not self.db.is_open():
+            self.db.open()
+            self.db.create_table()
+            if self.seen_filter:
+                self.db.load_seen_filter(self.seen_filter['file'], self.seen_filter['capacity'], self.seen_filter['error_rate'])
 
-            for listing in housing_query.get_results(sort_by='newest', geotagged=False, include_details=False):
-                if self.is_new_housing(listing):
-                    url = listing['url']
-                    logging.info(f'Found new craigslist house: {url}')
+        if self.geo_filter['enabled'] and self.search_area is None:
+            self.search_area = self.setup_search_area()
 
-                    self.fetch_more_details(housing_query, listing)
-                    logging.info('Fetched more details about the house')
+        if self.drainer:
+            self.check_outbox()
+            # Picks up whatever an earlier run left undelivered
+            self.drainer.start()
+            self.drainer.notify()
 
-                    self.insert_housing(listing)
-                    logging.info('Inserted house into database')
-
-                    if self.notify:
-                        attachment = self.format_attachment(listing)
-                        message = self.slack.send_message_to_channel(attachments=attachment)
-                        reply = self.generate_reply(listing)
-                        slack_message = self.slack.send_message_to_channel(message=reply, thread_ts=message['ts'])
-                        logging.info(f'Notified slack channel of listing')
-
-        zillow_searches = [
-            '{"mapBounds":{"west":-122.20709478930667,"east":-121.88780462817385,"south":37.27609897350297,"north":37.471449369286226},"usersSearchTerm":"Mountain View CA","isMapVisible":true,"mapZoom":12,"filterState":{"price":{"min":0,"max":1584322},"monthlyPayment":{"min":0,"max":6000},"beds":{"min":4,"max":4},"baths":{"min":3},"sortSelection":{"value":"days"},"isForSaleByAgent":{"value":false},"isForSaleByOwner":{"value":false},"isNewConstruction":{"value":false},"isForSaleForeclosure":{"value":false},"isComingSoon":{"value":false},"isAuction":{"value":false},"isPreMarketForeclosure":{"value":false},"isPreMarketPreForeclosure":{"value":false},"isMakeMeMove":{"value":false},"isForRent":{"value":true},"isCondo":{"value":false},"isMultiFamily":{"value":false}},"isListVisible":true,"customRegionId":"96bc65cef7X1-CR1ibhyilzdzibi_vx0sv"}'
-        ]
-
-        logging.info('Fetching zillow housing')
-        for zillow_search in zillow_searches:
-            results = self.fetch_zillow_housing(zillow_search)
-
-            for listing in results:
-                if self.is_new_housing(listing):
-                    url = listing['url']
-                    logging.info(f'Found new zillow house: {url}')
-
-                    self.fetch_zillow_housing_details(listing)
-                    logging.info('Fetched more details about the house')
-
-                    self.insert_housing(listing)
-                    logging.info('Inserted house into database')
-
-                    if self.notify:
-                        attachment = self.format_attachment(listing)
-                        message = self.slack.send_message_to_channel(attachments=attachment)
-                        reply = self.generate_reply(listing)
-                        slack_message = self.slack.send_message_to_channel(message=reply, thread_ts=message['ts'])
-                        logging.info(f'Notified slack channel of listing')
-
-    def fetch_zillow_housing(self, query):
-        url = 'https://www.zillow.com/search/GetSearchPageState.htm'
-        params = {
-            'searchQueryState': query,
-            'includeMap': 'false',
-            'includeList': 'true'
-        }
+        self.fetch_housing()
 
-        headers = {
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.169 Safari/537.36',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Cache-Control': 'no-cache',
-            'Pragma': 'no-cache',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Referrer': 'https://www.zillow.com/homes/?searchQueryState={%22mapBounds%22:{%22west%22:-122.21854364648436,%22east%22:-121.89925348535155,%22south%22:37.268739809818555,%22north%22:37.46410934451267},%22usersSearchTerm%22:%2294040%22,%22isMapVisible%22:true,%22mapZoom%22:12,%22filterState%22:{%22price%22:{%22min%22:0,%22max%22:1584707},%22monthlyPayment%22:{%22min%22:0,%22max%22:6000},%22beds%22:{%22min%22:4,%22max%22:4},%22baths%22:{%22min%22:2},%22sortSelection%22:{%22value%22:%22days%22},%22isForSaleByAgent%22:{%22value%22:false},%22isForSaleByOwner%22:{%22value%22:false},%22isNewConstruction%22:{%22value%22:false},%22isForSaleForeclosure%22:{%22value%22:false},%22isComingSoon%22:{%22value%22:false},%22isAuction%22:{%22value%22:false},%22isPreMarketForeclosure%22:{%22value%22:false},%22isPreMarketPreForeclosure%22:{%22value%22:false},%22isMakeMeMove%22:{%22value%22:false},%22isForRent%22:{%22value%22:true},%22isCondo%22:{%22value%22:false},%22isMultiFamily%22:{%22value%22:false}},%22isListVisible%22:true,%22pagination%22:{%22currentPage%22:2}}',
-        }
+        if self.drainer:
+            self.deliver_outbox(final=True)
 
-        response = requests.get(url=url, params=params, headers=headers)
-        json = response.json()
-
-        listings = []
-        for entry in json['searchResults']['listResults']:
-            listings.append({
-                'id': entry['zpid'],
-                'name': entry['statusText'] + ' - ' + entry['address'],
-                'price': entry['price'],
-                'bedrooms': entry['beds'],
-                'bathrooms': entry['baths'],
-                'gaddress': entry['address'],
-                'area': str(entry['area']),
-                'url': entry['detailUrl'],
-                'map_accuracy': 0,
-                'rooms': f"{entry['beds']}BR / {entry['baths']}Ba",
-                'provider': 'Zillow'
-            })
+        if self.seen_filter:
+            self.db.save_seen_filter(self.seen_filter['file'])
 
-        return listings
+    def shutdown(self):
+        if self.drainer:
+            self.drainer.stop()
+        super().shutdown()
+        if self.db.is_open():
+            self.db.close()
 
-    def fetch_zillow_housing_details(self, listing):
-        url = 'https://www.zillow.com/graphql/'
-        payload = '{"operationName":"ForRentDoubleScrollFullRenderQuery","variables":{"zpid":' + listing['id'] + ',"contactFormRenderParameter":{"zpid":19596588,"platform":"desktop","isDoubleScroll":true}},"clientVersion":"home-details/5.44.1.0.0.hotfix-2019-5-28.59e2dc6","queryId":"0b39af348a5c57b66a90385dad30bcab"}'
-
-        headers = {
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.169 Safari/537.36',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Content-Type': 'text/plain',
-            'Cache-Control': 'no-cache',
-            'Pragma': 'no-cache',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Referrer': 'https://www.zillow.com/homes/?searchQueryState={%22mapBounds%22:{%22west%22:-122.21854364648436,%22east%22:-121.89925348535155,%22south%22:37.268739809818555,%22north%22:37.46410934451267},%22usersSearchTerm%22:%2294040%22,%22isMapVisible%22:true,%22mapZoom%22:12,%22filterState%22:{%22price%22:{%22min%22:0,%22max%22:1584707},%22monthlyPayment%22:{%22min%22:0,%22max%22:6000},%22beds%22:{%22min%22:4,%22max%22:4},%22baths%22:{%22min%22:2},%22sortSelection%22:{%22value%22:%22days%22},%22isForSaleByAgent%22:{%22value%22:false},%22isForSaleByOwner%22:{%22value%22:false},%22isNewConstruction%22:{%22value%22:false},%22isForSaleForeclosure%22:{%22value%22:false},%22isComingSoon%22:{%22value%22:false},%22isAuction%22:{%22value%22:false},%22isPreMarketForeclosure%22:{%22value%22:false},%22isPreMarketPreForeclosure%22:{%22value%22:false},%22isMakeMeMove%22:{%22value%22:false},%22isForRent%22:{%22value%22:true},%22isCondo%22:{%22value%22:false},%22isMultiFamily%22:{%22value%22:false}},%22isListVisible%22:true,%22pagination%22:{%22currentPage%22:2}}',
-        }
+    def fetch_housing(self):
+        # Details are fetched per listing, then the run's new listings are ranked together and stored and notified in value order
+        details = [Stage('details', self.fetch_listing_details, self.workers['details'])]
+        # Always one worker: insert_housing relies on seeing the listings one at a time to catch duplicates within a run
+        storage = [Stage('database', self.insert_housing)]
 
-        response = requests.post(url=url, data=payload, headers=headers)
-        json = response.json()
+        # Every search of every provider is its own discovery source, so they all run at once
+        sources = [functools.partial(self.discover_housing, self.provider(name), search) for (name, searches) in self.searches.items() for search in searches or []]
 
-        listing['posted'] = 'N/A'
+        try:
+            with Pipeline(details, metrics=self.metrics) as pipeline, Pipeline(storage, metrics=self.metrics) as database, \
+                    ThreadPoolExecutor(max_workers=self.workers['notify'], thread_name_prefix='notify') as notifier:
+                listings = pipeline.run(self.unique_listings(pipeline.discover(sources, workers=self.workers['discovery'])))
+                for listing in database.run(self.rank_listings(list(listings))):
+                    if self.notify and not self.drainer:
+                        self.notify_listing(listing, notifier)
+        finally:
+            try:
+                if self.digest:
+                    self.digest.flush()
+            finally:
+                with self.metrics.timer('db_flush'):
+                    self.db.flush_housing_listings()
+
+        for provider in self.providers.values():
+            provider.finish()
+
+    def provider(self, name):
+        # Providers are imported on first use: python-craigslist fetches the site list over the network at import
+        if name not in self.providers:
+            module = importlib.import_module(self.provider_modules[name]['module'])
+            self.providers[name] = getattr(module, self.provider_modules[name]['class'])(self)
+        return self.providers[name]
+
+    def discover_housing(self, provider, search):
+        logger.info(f'Fetching {provider.name} housing')
+
+        with self.metrics.timer(f'{provider.name}_search'):
+            for listing in provider.search(search, self.unseen_ids):
+                logger.info(f'Found new {provider.name} house: {listing["url"]}')
+                self.metrics.increment('listings_new')
+                yield (provider, search, listing)
+
+    def unseen_ids(self, listing_ids):
+        listing_ids = list(listing_ids)
+        self.metrics.increment('listings_seen', len(listing_ids))
+        with self.metrics.timer('db_unseen'):
+            return self.db.unseen_craigslist_ids(listing_ids)
+
+    def unique_listings(self, items):
+        # The same listing can come back from overlapping searches
+        seen = set()
+        for item in items:
+            listing_id = item[2]['id']
+            if listing_id not in seen:
+                seen.add(listing_id)
+                yield item
+
+    def fetch_listing_details(self, item):
+        (provider, search, listing) = item
+
+        if self.search_area:
+            (location, exact) = self.listing_location(listing)
+            if location and not self.search_area.contains(*location):
+                if not exact:
+                    # Only its neighbourhood is outside: not stored, so a later run (or its detail page) can still decide
+                    logger.info(f'Skipping house whose neighbourhood is outside the search area: {listing["url"]}')
+                    self.metrics.increment('listings_outside_area_guess')
+                    return None
+
+                logger.info(f'Skipping details of house outside the search area: {listing["url"]}')
+                self.metrics.increment('listings_outside_area')
+                listing['outside_area'] = True
+                return listing
+
+        # Search results often carry enough (repost_of, address, rooms, price) to spot a duplicate without the detail page
+        listing['duplicate_of'] = self.find_duplicate(listing)
+        if listing['duplicate_of']:
+            logger.info(f'Skipping details of duplicate house: {listing["url"]}')
+            self.metrics.increment('details_skipped')
+            return listing
+
+        provider.enrich(search, listing)
+        logger.info(f'Fetched more details about the house: {listing["url"]}')
+        return listing
+
+    def setup_search_area(self):
+        # Markers without coordinates in housing.yaml are geocoded once (see maps.geocode)
+        centers = []
+        if self.geo_filter['max_miles'] is not None:
+            for marker in self.map_markers:
+                if marker.get('latitude') is not None and marker.get('longitude') is not None:
+                    centers.append((float(marker['latitude']), float(marker['longitude'])))
+                    continue
+                geocode = self.geocodes.lookup(marker['address'])
+                if geocode['latitude'] is None:
+                    logger.warning(f'No coordinates for map marker {marker["address"]}, set its latitude and longitude')
+                    continue
+                centers.append((geocode['latitude'], geocode['longitude']))
+
+        polygons = [[tuple(float(value) for value in point) for point in polygon] for polygon in self.geo_filter['polygons'] or []]
+        search_area = SearchArea(centers, self.geo_filter['max_miles'], polygons)
+        if not search_area:
+            logger.warning('Geo filter enabled without any center or polygon, keeping every listing')
+        return search_area
+
+    def listing_location(self, listing):
+        # ((lat, lon), exact): the search result's geotag or geocoded address, else with `use_where`
+        # the centre of its neighbourhood, which is only a guess. Nothing to go on means the detail page decides.
+        coordinates = listing_coordinates(listing)
+        if coordinates:
+            return (coordinates, True)
+
+        texts = [(listing.get('gaddress'), True)]
+        if self.geo_filter['use_where']:
+            texts.append((listing.get('where'), False))
+
+        for (text, exact) in texts:
+            if text:
+                geocode = self.geocodes.lookup(text)
+                if geocode['latitude'] is not None:
+                    return ((geocode['latitude'], geocode['longitude']), exact)
+        return (None, False)
+
+    def notify_listing(self, listing, notifier):
+        if self.digest:
+            price_per_person = self.price_per_person(listing)
+            self.digest.add(self.format_digest_entry(listing, self.listing_band(listing)), key=(price_per_person < 0, price_per_person))
+            return
+
+        attachment = self.format_attachment(listing)
+        reply = self.generate_reply(listing)
+
+        # The queue paces messages per channel and sends the reply once its parent has a ts
+        if self.slack_queue:
+            message = self.slack_queue.send_message_to_channel(attachments=attachment)
+            self.slack_queue.send_message_to_channel(message=reply, parent=message)
+            logger.info(f'Queued slack notification of listing')
+            return
+
+        # Parent messages go out in discovery order, thread replies can go out concurrently
+        message = self.slack.send_message_to_channel(attachments=attachment)
+        notifier.submit(self.slack.send_message_to_channel, message=reply, thread_ts=message['ts'])
+        logger.info(f'Notified slack channel of listing')
+
+    def find_duplicate(self, listing):
+        if not self.duplicates['enabled']:
+            return None
 
-        for fact in json['data']['property']['homeFacts']['atAGlanceFacts']:
-            if fact['factLabel'] == 'Date available' and fact['factValue']:
-                if fact['factValue'] == 'Available now':
-                    listing['availability'] = datetime.datetime.now()
-                else:
-                    listing['availability'] = dateparser.parse(str(fact['factValue']))
+        repost_of = listing.get('repost_of')
+        if repost_of and not self.db.unseen_craigslist_ids([repost_of]):
+            return repost_of
 
-        for category in json['data']['property']['homeFacts']['categoryDetails']:
-            if category['categoryGroupName'] == 'Rental Facts':
-                category = category['categories'][0]
-                for fact in category['categoryFacts']:
-                    if fact['factLabel'] == 'Posted':
-                        listing['posted'] = dateparser.parse(fact['factValue'])
+        fingerprint = self.fingerprint(listing)
+        if fingerprint.searchable():
+            with self.metrics.timer('db_find_duplicate'):
+                return self.db.find_duplicate(fingerprint, self.duplicates['max_distance'], self.duplicates['cell_distance'], since=self.duplicate_since())
+        return None
 
-        if listing['posted'] == 'N/A':
-            listing['posted'] = dateparser.parse(json['data']['property']['timeOnZillow'])
+    def duplicate_since(self):
+        # The same place listed again months later is a new listing
+        return time.time() - self.duplicates['max_age_days'] * 86400
 
-        listing['body'] = json['data']['property']['description']
-        listing['image'] = json['data']['property']['desktopWebHdpImageLink']
-        listing['where'] = json['data']['property']['city']
+    def fingerprint(self, listing):
+        return Fingerprint.from_listing(listing, cell_size=self.duplicates['cell_size'], price_band=self.duplicates['price_band'])
 
-    def fetch_more_details(self, housing_query, result):
-        detail_soup = housing_query.fetch_content(result['url'])
-        housing_query.customize(result, detail_soup)
-        housing_query.geotag_result(result, detail_soup)
+    def insert_housing(self, listing):
+        if listing.get('outside_area'):
+            self.db.queue_housing_listing(self.listing_row(listing))
+            return None
 
-    def is_new_housing(self, listing):
-        return self.db.count_by_craigslist_id(craigslist_id=listing['id']) == 0
+        # The database stage runs on one worker, so checking the full listing here and
+        # queueing its fingerprint also catches duplicates found earlier in the same run
+        duplicate_of = listing.get('duplicate_of')
+        fingerprint = None
+        if not duplicate_of and self.duplicates['enabled']:
+            fingerprint = self.fingerprint(listing)
+            with self.metrics.timer('db_find_duplicate'):
+                duplicate_of = self.db.find_duplicate(fingerprint, self.duplicates['max_distance'], self.duplicates['cell_distance'], since=self.duplicate_since())
+
+        # Rendered before anything is queued, so a listing that can't be rendered isn't marked seen
+        message = self.outbox_message(listing) if self.drainer and not duplicate_of else None
+
+        # Rows are written in one transaction at the end of the run, duplicates too so they count as seen
+        row = self.listing_row(listing, duplicate_of)
+        self.db.queue_housing_listing(row)
+
+        if duplicate_of:
+            logger.info(f'Not notifying duplicate of {duplicate_of}: {listing["url"]}')
+            self.metrics.increment('listings_duplicate')
+            return None
 
-    def insert_housing(self, listing):
-        row = (listing['id'], listing['name'], listing['url'], self.listing_insert_time(listing), int(time.time()))
-        self.db.insert_housing_listing(row)
+        if fingerprint:
+            self.db.queue_fingerprint(fingerprint)
+        logger.info('Queued house for database insert')
+
+        if message:
+            self.db.queue_outbox(message)
+            # Commit in small batches so the drainer can start sending while the scrape goes on
+            if self.db.pending_count() >= self.outbox['batch_size']:
+                with self.metrics.timer('db_flush'):
+                    self.db.flush_housing_listings()
+                self.drainer.notify()
+        return listing
+
+    def listing_row(self, listing, duplicate_of=None):
+        # Everything a later query or re-ranking needs, so it never means scraping again
+        insert_time = self.listing_insert_time(listing)
+        created_at = int(time.time())
+        (latitude, longitude) = listing_coordinates(listing) or (None, None)
+        availability = listing.get('availability')
+        price_per_person = self.price_per_person(listing)
 
-    def format_message(self, listing):
-        color = self.listing_color_name(listing)
+        # The post time, else the search result's date, else when we first saw it (never the placeholder insert time)
+        posted = listing.get('updated') or listing.get('posted')
+        if isinstance(posted, datetime.datetime):
+            posted_at = int(posted.timestamp())
+        elif listing.get('timestamp') or listing.get('datetime'):
+            posted_at = insert_time
+        else:
+            posted_at = created_at
+
+        return (listing['id'], listing['name'], listing['url'], insert_time, created_at,
+            listing.get('provider') or 'Craigslist',
+            parse_price(listing.get('price')),
+            parse_rooms(listing.get('bedrooms')),
+            parse_rooms(listing.get('bathrooms')),
+            parse_area(listing.get('area')),
+            latitude,
+            longitude,
+            listing.get('gaddress'),
+            listing.get('where'),
+            int(availability.timestamp()) if isinstance(availability, datetime.datetime) else None,
+            posted_at,
+            listing.get('image'),
+            listing.get('body'),
+            str(duplicate_of) if duplicate_of else None,
+            price_per_person if price_per_person >= 0 else None,
+            self.listing_band(listing))
+
+    def outbox_message(self, listing):
+        now = int(time.time())
+        if self.digest:
+            price_per_person = self.price_per_person(listing)
+            entry = self.format_digest_entry(listing, self.listing_band(listing))
+            return (listing['id'], 'digest', price_per_person if price_per_person >= 0 else None, json.dumps(entry), None, now, now)
+        return (listing['id'], 'listing', None, self.format_attachment(listing), self.generate_reply(listing), now, now)
+
+    def deliver_outbox(self, final=False):
+        # The drainer thread and the end of a run both deliver, one at a time
+        with self.outbox_lock:
+            now = time.time()
+            messages = self.db.due_outbox(now, self.outbox['max_attempts'])
+
+            for message in messages:
+                if message['kind'] == 'listing':
+                    self.deliver_listing(message)
+
+            # Digest entries wait for the end of the run, the threshold or the window
+            digests = [message for message in messages if message['kind'] == 'digest']
+            if digests and (not self.digest or final or len(digests) >= self.digest.threshold or
+                    (self.digest.window is not None and min(message['created_at'] for message in digests) <= now - self.digest.window)):
+                self.deliver_digests(digests)
+
+    def deliver_listing(self, message):
+        ts = message['ts']
+        try:
+            if not ts:
+                ts = self.post_to_slack(attachments=message['attachments'])['ts']
+                self.db.outbox_posted(message['rowid'], ts)
+
+            reply_ts = None
+            if message['reply']:
+                reply_ts = self.post_to_slack(message=message['reply'], thread_ts=ts)['ts']
+
+            self.db.outbox_sent([message['rowid']], ts, reply_ts)
+            self.metrics.increment('notifications_sent')
+            logger.info(f'Notified slack channel of listing {message["craigslist_id"]}')
+        except Exception as e:
+            self.retry_outbox([message], e)
+
+    def deliver_digests(self, messages):
+        messages = sorted(messages, key=lambda message: (message['sort_key'] is None, message['sort_key'] or 0, message['rowid']))
+        # Entries left over from a run with digest mode on still go out if it has been turned off since
+        digest = self.digest or Digest(self.send_digest)
+        chunks = list(digest.chunks(messages, size_of=lambda message: len(message['attachments'])))
+
+        for (index, chunk) in enumerate(chunks):
+            try:
+                result = self.send_digest([json.loads(message['attachments']) for message in chunk], index, len(chunks))
+                self.db.outbox_sent([message['rowid'] for message in chunk], result['ts'])
+                self.metrics.increment('notifications_sent', len(chunk))
+            except Exception as e:
+                self.retry_outbox(chunk, e)
+
+    def retry_outbox(self, messages, error):
+        attempts = max(message['attempts'] for message in messages) + 1
+        delay = min(self.outbox['backoff'] * 2 ** (attempts - 1), self.outbox['max_backoff'])
+        self.metrics.increment('notifications_failed', len(messages))
+        logger.warning(f'Failed to send {len(messages)} notifications (attempt {attempts}), retrying in {delay}s: {error}')
+        self.db.outbox_failed([message['rowid'] for message in messages], time.time() + delay, repr(error))
+
+        # Rows out of attempts are no longer due, they stay in the outbox until --retry-outbox
+        abandoned = [message['craigslist_id'] for message in messages if message['attempts'] + 1 >= self.outbox['max_attempts']]
+        if abandoned:
+            self.metrics.increment('notifications_abandoned', len(abandoned))
+            logger.error(f'Giving up on {len(abandoned)} notifications after {self.outbox["max_attempts"]} attempts ({", ".join(map(str, abandoned))}), '
+                'run with --retry-outbox to send them again')
+
+    def check_outbox(self):
+        if self.requeue_outbox:
+            requeued = self.db.requeue_outbox(self.outbox['max_attempts'])
+            logger.info(f'Requeued {requeued} notifications that ran out of attempts')
+            self.requeue_outbox = False
+
+        abandoned = self.db.abandoned_count(self.outbox['max_attempts'])
+        if abandoned:
+            logger.error(f'{abandoned} notifications ran out of attempts and will not be sent, run with --retry-outbox to send them again')
+
+    def post_to_slack(self, message=None, attachments=None, thread_ts=None):
+        if self.slack_queue:
+            return self.slack_queue.send_message_to_channel(message=message, attachments=attachments, thread_ts=thread_ts).result()
+        return self.slack.send_message_to_channel(message=message, attachments=attachments, thread_ts=thread_ts)
+
+    def format_message(self, listing, band=None):
+        color = self.listing_color_name(listing, band)
         name = listing['name']
         price = listing['price']
         url = listing['url']
         return f'[{color}] {name} - {price}: {url}'
 
-    def listing_color(self, listing):
-        colors = {
-            'unknown': '#FFFFFF',
-            'green': '#008000',
-            'orange': '#FFA500',
-            'red': '#FF0000',
-        }
+    def rank_listings(self, listings):
+        # Scores every new listing of the run at once and returns them best value first
+        with self.metrics.timer('score_run'):
+            scores = ListingScores.from_listings(listings)
+            scores.apply(listings)
+        return [listings[index] for index in scores.order()]
 
-        price_per_person = self.price_per_person(listing)
+    def score_listings(self, listings):
+        # For a listing that didn't come through rank_listings
+        listings = list(listings)
+        return ListingScores.from_listings(listings).apply(listings)
 
-        if price_per_person < 0:
-            return colors['unknown']
-        elif price_per_person > 700 and price_per_person <= 1300:
-            return colors['green']
-        elif price_per_person > 1300 and price_per_person <= 1600:
-            return colors['orange']
-        else:
-            return colors['red']
+    def listing_band(self, listing):
+        if 'band' not in listing:
+            self.score_listings([listing])
+        return listing['band']
 
-    def listing_color_name(self, listing):
-        price_per_person = self.price_per_person(listing)
+    def listing_color(self, listing, band=None):
+        return self.colors[band or self.listing_band(listing)]
 
-        if price_per_person < 0:
-            return '?'
-        elif price_per_person > 700 and price_per_person <= 1300:
-            return '$'
-        elif price_per_person > 1300 and price_per_person <= 1600:
-            return '$$'
-        else:
-            return '$$$'
+    def listing_color_name(self, listing, band=None):
+        return self.color_names[band or self.listing_band(listing)]
 
     def price_per_person(self, listing):
-        if '/mo' in listing['price']:
-            price = float(listing['price'][1:-3].replace(',',''))
-        else:
-            price = float(listing['price'][1:])
-        bedrooms = float(listing['bedrooms'])
-        bathrooms = float(listing['bathrooms'])
-
-        # bathrooms is zero
-        if math.isclose(bathrooms, 0):
-            return price / bedrooms
-
-        #price per person = price / ((0.7 * beds) + (0.3 * baths))
-        return (price / ((0.7 * bedrooms) + (0.3 * bathrooms)))
+        # -1 when the price or bedrooms are unknown
+        if 'price_per_person' not in listing:
+            self.score_listings([listing])
+        return listing['price_per_person']
 
     def listing_insert_time(self, listing):
-        if 'datetime' in listing:
-            return int(parser.parse(listing['datetime']).timestamp())
-        return 1559197920
+        # Craigslist results are parsed once during discovery
+        if listing.get('timestamp'):
+            return listing['timestamp']
+        if listing.get('datetime'):
+            return int(parse_date(listing['datetime']).timestamp())
+        return self.placeholder_insert_time
         # return None
 
     def listing_time(self, listing):
@@ -387,10 +604,41 @@ class HousingBot(Bot):
                 return listing['area']
         return 'N/A'
 
-    def create_map_url(self, listing):
-        if not listing['gaddress'] and not listing['geotag']:
+    def setup_maps(self, maps_config):
+        from motionless import AddressMarker
+        from bot.geocode import GeocodeCache
+
+        self.maps_config = {'geocode': False, 'url_cache_size': 1024, **maps_config}
+
+        # The configured markers are the same on every map
+        self.static_markers = [AddressMarker(marker['address'], label=marker['label']) for marker in self.map_markers]
+        self.map_url = functools.lru_cache(maxsize=self.maps_config['url_cache_size'])(self.generate_map_url)
+        self.geocodes = GeocodeCache(os.path.splitext(self.db.db_file)[0] + '.geocode.db', http=self.http, api_key=self.google_api_key if self.maps_config['geocode'] else None)
+
+    def map_location(self, listing):
+        # The marker, title and text all follow this: a precise address, else the approximate map area
+        if listing.get('gaddress') and listing.get('map_accuracy', 0) <= 10:
+            return ('address', listing['gaddress'])
+        if listing.get('geotag'):
+            return ('geotag', round(float(listing['geotag'][0]), 5), round(float(listing['geotag'][1]), 5))
+        return None
+
+    def create_map_url(self, listing, location=None):
+        location = location or self.map_location(listing)
+        if not location:
             return None
 
+        # Reposts and other spellings of a known address resolve to the same marker and cached URL
+        if location[0] == 'address':
+            geocode = self.geocodes.lookup(location[1])
+            if geocode['latitude'] is not None:
+                return self.map_url(('point', geocode['latitude'], geocode['longitude'], '1'))
+            return self.map_url(('address', geocode['address'], '1'))
+        return self.map_url(('point', location[1], location[2], '0'))
+
+    def generate_map_url(self, marker):
+        from motionless import DecoratedMap, AddressMarker, LatLonMarker
+
         road_styles = [{
             'feature': 'road.highway',
             'element': 'geomoetry',
@@ -407,37 +655,35 @@ class HousingBot(Bot):
         }]
 
         dmap = DecoratedMap(style=road_styles,key=self.google_api_key)
-        for marker in self.map_markers:
-            dmap.add_marker(AddressMarker(marker['address'], label=marker['label']))
+        dmap.markers = list(self.static_markers)
 
-        if listing['gaddress'] and listing['map_accuracy'] <= 10:
-            dmap.add_marker(AddressMarker(listing['gaddress'], label='1', color='blue'))
-        elif listing['geotag']:
-            dmap.add_marker(LatLonMarker(listing['geotag'][0], listing['geotag'][1], label='0', color='blue'))
+        if marker[0] == 'address':
+            dmap.add_marker(AddressMarker(marker[1], label=marker[2], color='blue'))
+        else:
+            dmap.add_marker(LatLonMarker(marker[1], marker[2], label=marker[3], color='blue'))
 
         return dmap.generate_url()
 
-    def map_title(self, listing):
-        if not listing['gaddress'] and not listing['geotag']:
+    def map_title(self, listing, location=None):
+        location = location or self.map_location(listing)
+        if not location:
             return None
 
-        if listing['gaddress'] and listing['map_accuracy'] <= 10:
+        if location[0] == 'address':
             return f'Provided address'
+        return f'Approximate location via map area'
 
-        if listing['geotag']:
-            return f'Approximate location via map area'
-
-    def map_text(self, listing):
-        if not listing['gaddress'] and not listing['geotag']:
+    def map_text(self, listing, location=None):
+        location = location or self.map_location(listing)
+        if not location:
             return None
 
-        if listing['gaddress'] and listing['map_accuracy'] <= 10:
-            return listing['gaddress'].title()
+        if location[0] == 'address':
+            return location[1].title()
 
-        if listing['geotag']:
-            latitude = listing['geotag'][0]
-            longitude = listing['geotag'][1]
-            return f'(latitude: {latitude}, longitude: {longitude})'
+        latitude = listing['geotag'][0]
+        longitude = listing['geotag'][1]
+        return f'(latitude: {latitude}, longitude: {longitude})'
 
     def generate_reply(self, listing):
         day = datetime.datetime.now(tz=self.timezone).strftime('%A')
@@ -454,12 +700,14 @@ class HousingBot(Bot):
 
 
     def format_attachment(self, listing):
-        map_url = self.create_map_url(listing)
+        location = self.map_location(listing)
+        map_url = self.create_map_url(listing, location)
+        band = self.listing_band(listing)
 
         attachments = [{
-            'fallback': self.format_message(listing) + ' - ' + listing['provider'],
-            'color': self.listing_color(listing),
-            'title': '[' + self.listing_color_name(listing) + '] ' + listing['name'] + ' - ' + listing['provider'],
+            'fallback': self.format_message(listing, band) + ' - ' + listing['provider'],
+            'color': self.listing_color(listing, band),
+            'title': '[' + self.listing_color_name(listing, band) + '] ' + listing['name'] + ' - ' + listing['provider'],
             'title_link': listing['url'],
             'image_url': listing['image'],
             'text': listing['body'],
@@ -502,14 +750,33 @@ class HousingBot(Bot):
         if map_url:
             attachments.append({
                 'image_url': map_url,
-                'color': self.listing_color(listing),
-                'title': self.map_title(listing),
-                'text': self.map_text(listing),
+                'color': self.listing_color(listing, band),
+                'title': self.map_title(listing, location),
+                'text': self.map_text(listing, location),
                 'footer': 'Google Maps',
             })
 
         return json.dumps(attachments)
 
+    def format_digest_entry(self, listing, band):
+        # One compact attachment per listing, no thread reply
+        details = [listing['price'], listing['rooms'], listing['where'].title(), f'{self.listing_area(listing)} sq ft', f'available {self.listing_availability(listing)}']
+        return {
+            'fallback': self.format_message(listing, band) + ' - ' + listing['provider'],
+            'color': self.listing_color(listing, band),
+            'title': '[' + self.listing_color_name(listing, band) + '] ' + listing['name'] + ' - ' + listing['provider'],
+            'title_link': listing['url'],
+            'text': ' | '.join(str(detail) for detail in details if detail),
+            'thumb_url': self.create_map_url(listing),
+            'ts': self.listing_time(listing),
+        }
+
+    def send_digest(self, attachments, index, total):
+        message = f'{len(attachments)} new houses' + (f' ({index + 1}/{total})' if total > 1 else '')
+        result = self.post_to_slack(message=message, attachments=json.dumps(attachments))
+        logger.info(f'Notified slack channel of {len(attachments)} listings')
+        return result
+
 class SQL(object):
 
     create_statement = """
@@ -523,50 +790,469 @@ class SQL(object):
         );
     """
 
-    def __init__(self, db_file):
+    # Everything else we know about a listing, added to older databases by migrate()
+    listing_columns = [
+        ('provider', 'TEXT'),
+        ('price', 'REAL'),
+        ('bedrooms', 'REAL'),
+        ('bathrooms', 'REAL'),
+        ('area', 'REAL'),
+        ('latitude', 'REAL'),
+        ('longitude', 'REAL'),
+        ('address', 'TEXT'),
+        ('location', 'TEXT'),
+        ('available_at', 'INTEGER'),
+        ('posted_at', 'INTEGER'),
+        ('image', 'TEXT'),
+        ('body', 'TEXT'),
+        ('duplicate_of', 'TEXT'),
+        ('price_per_person', 'REAL'),
+        ('band', 'TEXT'),
+    ]
+
+    create_listing_index_statements = [
+        'CREATE INDEX IF NOT EXISTS craigslist_housing_price ON craigslist_housing (price)',
+        'CREATE INDEX IF NOT EXISTS craigslist_housing_bedrooms ON craigslist_housing (bedrooms, price)',
+        'CREATE INDEX IF NOT EXISTS craigslist_housing_provider ON craigslist_housing (provider)',
+        'CREATE INDEX IF NOT EXISTS craigslist_housing_posted_at ON craigslist_housing (posted_at)',
+        'CREATE INDEX IF NOT EXISTS craigslist_housing_price_per_person ON craigslist_housing (price_per_person)',
+        'CREATE INDEX IF NOT EXISTS craigslist_housing_band ON craigslist_housing (band)',
+    ]
+
+    # External content FTS5 index over name and body, kept in sync by triggers
+    create_full_text_statements = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS craigslist_housing_fts USING fts5(name, body, content='craigslist_housing', content_rowid='rowid')",
+        """CREATE TRIGGER IF NOT EXISTS craigslist_housing_fts_insert AFTER INSERT ON craigslist_housing BEGIN
+            INSERT INTO craigslist_housing_fts (rowid, name, body) VALUES (new.rowid, new.name, new.body);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS craigslist_housing_fts_delete AFTER DELETE ON craigslist_housing BEGIN
+            INSERT INTO craigslist_housing_fts (craigslist_housing_fts, rowid, name, body) VALUES ('delete', old.rowid, old.name, old.body);
+        END""",
+        # Only name and body are indexed, so rescoring or marking duplicates doesn't rewrite the index
+        'DROP TRIGGER IF EXISTS craigslist_housing_fts_update',
+        """CREATE TRIGGER craigslist_housing_fts_update AFTER UPDATE OF name, body ON craigslist_housing BEGIN
+            INSERT INTO craigslist_housing_fts (craigslist_housing_fts, rowid, name, body) VALUES ('delete', old.rowid, old.name, old.body);
+            INSERT INTO craigslist_housing_fts (rowid, name, body) VALUES (new.rowid, new.name, new.body);
+        END""",
+    ]
+
+    create_search_state_statement = """
+        CREATE TABLE IF NOT EXISTS search_state (
+            search_key TEXT NOT NULL,
+            high_water INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL,
+            UNIQUE (search_key)
+        );
+    """
+
+    create_fingerprint_statements = ["""
+        CREATE TABLE IF NOT EXISTS listing_fingerprints (
+            craigslist_id TEXT NOT NULL,
+            address TEXT NULL,
+            cell_lat INTEGER NULL,
+            cell_lon INTEGER NULL,
+            bedrooms REAL NULL,
+            bathrooms REAL NULL,
+            price_band INTEGER NULL,
+            body_hash INTEGER NULL,
+            band0 INTEGER NULL,
+            band1 INTEGER NULL,
+            band2 INTEGER NULL,
+            band3 INTEGER NULL,
+            created_at INTEGER NOT NULL,
+            UNIQUE (craigslist_id)
+        );
+    """,
+        'CREATE INDEX IF NOT EXISTS listing_fingerprints_address ON listing_fingerprints (address)',
+        'CREATE INDEX IF NOT EXISTS listing_fingerprints_cell ON listing_fingerprints (cell_lat, cell_lon)',
+        'CREATE INDEX IF NOT EXISTS listing_fingerprints_band0 ON listing_fingerprints (band0)',
+        'CREATE INDEX IF NOT EXISTS listing_fingerprints_band1 ON listing_fingerprints (band1)',
+        'CREATE INDEX IF NOT EXISTS listing_fingerprints_band2 ON listing_fingerprints (band2)',
+        'CREATE INDEX IF NOT EXISTS listing_fingerprints_band3 ON listing_fingerprints (band3)',
+    ]
+
+    create_outbox_statements = ["""
+        CREATE TABLE IF NOT EXISTS outbox (
+            craigslist_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            sort_key REAL NULL,
+            attachments TEXT NULL,
+            reply TEXT NULL,
+            ts TEXT NULL,
+            reply_ts TEXT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at INTEGER NOT NULL,
+            last_error TEXT NULL,
+            created_at INTEGER NOT NULL,
+            sent_at INTEGER NULL,
+            UNIQUE (craigslist_id)
+        );
+    """,
+        'CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (sent_at, next_attempt_at)',
+    ]
+
+    journal_modes = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+    synchronous_modes = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+    # SQLite allows at most 999 bound parameters per statement
+    max_variables = 900
+
+    # Listings scored per batch when backfilling price per person
+    score_batch_size = 10000
+
+    def __init__(self, db_file, journal_mode='WAL', synchronous='NORMAL'):
         self.db_file = db_file
+        self.connection = None
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.pending_listings = []
+        self.pending_fingerprints = []
+        self.pending_outbox = []
+        self.full_text = False
+        self.seen_filter = None
+        # The connection is shared by the pipeline threads
+        self.lock = threading.Lock()
 
     def open(self):
         try:
-            logging.debug(f'Trying to create connection from file: {self.db_file}')
-            self.connection = sqlite3.connect(self.db_file)
-            logging.debug(f'Created connection: {self.connection}')
+            logger.debug(f'Trying to create connection from file: {self.db_file}')
+            self.connection = sqlite3.connect(self.db_file, check_same_thread=False)
+            logger.debug(f'Created connection: {self.connection}')
+            self.configure()
         except Error as e:
-            logging.error(e)
+            logger.error(e)
+
+    def configure(self):
+        journal_mode = str(self.journal_mode).upper()
+        synchronous = str(self.synchronous).upper()
+
+        if journal_mode in self.journal_modes:
+            self.connection.execute(f'PRAGMA journal_mode = {journal_mode}')
+        else:
+            logger.error(f'Ignoring unknown sqlite journal mode: {self.journal_mode}')
+
+        if synchronous in self.synchronous_modes:
+            self.connection.execute(f'PRAGMA synchronous = {synchronous}')
+        else:
+            logger.error(f'Ignoring unknown sqlite synchronous setting: {self.synchronous}')
+
+        logger.debug(f'Configured sqlite journal_mode = {journal_mode}, synchronous = {synchronous}')
+
+    def is_open(self):
+        return self.connection is not None
 
     def close(self):
-        logging.debug(f'Closing sqlite file: {self.db_file} connection: {self.connection}')
+        logger.debug(f'Closing sqlite file: {self.db_file} connection: {self.connection}')
         self.connection.close()
-        logging.debug(f'Closed sqlite file: {self.db_file} connection: {self.connection}')
+        logger.debug(f'Closed sqlite file: {self.db_file} connection: {self.connection}')
+        self.connection = None
 
     def create_table(self):
         try:
             cursor = self.connection.cursor()
             cursor.execute(self.create_statement)
+            self.migrate()
+            cursor.execute(self.create_search_state_statement)
+            for statement in self.create_fingerprint_statements + self.create_outbox_statements + self.create_listing_index_statements:
+                cursor.execute(statement)
+            self.connection.commit()
         except Error as e:
-            logging.error(e)
+            logger.error(e)
 
-    def count_by_craigslist_id(self, craigslist_id):
+        self.create_full_text_index()
+        self.backfill_scores()
+
+    def migrate(self):
         cursor = self.connection.cursor()
-        cursor.execute('SELECT COUNT(rowid) FROM craigslist_housing WHERE craigslist_id = ?', (craigslist_id,))
-        count = cursor.fetchone()[0]
-        logging.debug(f'Count for ID = {craigslist_id}: {count}')
-        return count
+        cursor.execute('PRAGMA table_info(craigslist_housing)')
+        existing = {row[1] for row in cursor.fetchall()}
+
+        for (name, column_type) in self.listing_columns:
+            if name not in existing:
+                logger.info(f'Adding column craigslist_housing.{name}')
+                cursor.execute(f'ALTER TABLE craigslist_housing ADD COLUMN {name} {column_type} NULL')
 
-    def insert_housing_listing(self, listing):
-        insert = ''' INSERT INTO craigslist_housing (craigslist_id, name, url, craigslist_date, created_at) VALUES (?, ?, ?, ?, ?) '''
+        # Rows stored with the placeholder insert time as their post time were first seen at created_at
+        cursor.execute('UPDATE craigslist_housing SET posted_at = created_at WHERE posted_at = ?', (HousingBot.placeholder_insert_time,))
+
+    def create_full_text_index(self):
+        # Not every SQLite build has FTS5, text search is simply unavailable without it
         cursor = self.connection.cursor()
-        cursor.execute(insert, listing)
-        self.connection.commit()
-        logging.debug(f'Inserting listing: {listing}')
-        return cursor.lastrowid
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'craigslist_housing_fts'")
+        exists = cursor.fetchone()[0] > 0
+
+        try:
+            for statement in self.create_full_text_statements:
+                cursor.execute(statement)
+            if not exists:
+                cursor.execute("INSERT INTO craigslist_housing_fts (craigslist_housing_fts) VALUES ('rebuild')")
+            self.connection.commit()
+            self.full_text = True
+        except Error as e:
+            logger.warning(f'Full text search unavailable: {e}')
+            self.full_text = False
+
+    def backfill_scores(self, rescore=False):
+        # Listings stored before scoring (or all of them after the bands change), scored a batch of columns at a time
+        select = 'SELECT rowid, price, bedrooms, bathrooms FROM craigslist_housing WHERE rowid > ?' + ('' if rescore else ' AND band IS NULL') + ' ORDER BY rowid LIMIT ?'
+        update = 'UPDATE craigslist_housing SET price_per_person = ?, band = ? WHERE rowid = ?'
+        (last_rowid, total) = (0, 0)
+
+        with self.lock:
+            cursor = self.connection.cursor()
+            while True:
+                cursor.execute(select, (last_rowid, self.score_batch_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+
+                (rowids, prices, bedrooms, bathrooms) = zip(*rows)
+                scores = ListingScores.from_columns(prices, bedrooms, bathrooms)
+                cursor.executemany(update, zip((value if value >= 0 else None for value in scores.price_per_person), scores.bands, rowids))
+                (last_rowid, total) = (rowids[-1], total + len(rows))
+            self.connection.commit()
+
+        if total:
+            logger.info(f'Scored {total} stored listings')
+        return total
+
+    def get_high_water(self, search_key):
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute('SELECT high_water FROM search_state WHERE search_key = ?', (search_key,))
+            row = cursor.fetchone()
+        logger.debug('High water mark for %s: %s', search_key, row)
+        return row[0] if row else None
+
+    def set_high_water(self, search_key, high_water):
+        upsert = ''' INSERT OR REPLACE INTO search_state (search_key, high_water, updated_at) VALUES (?, ?, ?) '''
+        with self.lock:
+            self.connection.execute(upsert, (search_key, high_water, int(time.time())))
+            self.connection.commit()
+        logger.debug('Set high water mark for %s: %s', search_key, high_water)
+
+    def load_seen_filter(self, filter_file, capacity, error_rate):
+        seen_filter = BloomFilter.load(filter_file) if os.path.exists(filter_file) else None
+
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute('SELECT COUNT(rowid), MAX(rowid) FROM craigslist_housing')
+            (count, max_rowid) = cursor.fetchone()
+            max_rowid = max_rowid or 0
+
+            # Rebuild when the sidecar is missing, outgrown or ahead of the table (e.g. the db was replaced)
+            if seen_filter is None or seen_filter.marker > max_rowid or count > seen_filter.capacity:
+                seen_filter = BloomFilter(max(capacity, count * 2), error_rate=error_rate)
+                logger.info(f'Building seen filter for {count} listings')
+
+            cursor.execute('SELECT craigslist_id FROM craigslist_housing WHERE rowid > ?', (seen_filter.marker,))
+            for (craigslist_id,) in cursor:
+                seen_filter.add(craigslist_id)
+
+            seen_filter.marker = max_rowid
+            self.seen_filter = seen_filter
+
+        logger.debug(f'Seen filter holds {seen_filter.count} listings')
+
+    def save_seen_filter(self, filter_file):
+        if self.seen_filter:
+            with self.lock:
+                self.seen_filter.save(filter_file)
+
+    def unseen_craigslist_ids(self, craigslist_ids):
+        craigslist_ids = list(dict.fromkeys(str(craigslist_id) for craigslist_id in craigslist_ids))
+        seen = set()
+
+        # Anything the filter has never seen is new without asking SQLite
+        candidates = craigslist_ids
+        if self.seen_filter:
+            candidates = [craigslist_id for craigslist_id in craigslist_ids if craigslist_id in self.seen_filter]
+
+        with self.lock:
+            cursor = self.connection.cursor()
+            for start in range(0, len(candidates), self.max_variables):
+                chunk = candidates[start:start + self.max_variables]
+                placeholders = ', '.join('?' * len(chunk))
+                cursor.execute(f'SELECT craigslist_id FROM craigslist_housing WHERE craigslist_id IN ({placeholders})', chunk)
+                seen.update(row[0] for row in cursor.fetchall())
+
+        unseen = [craigslist_id for craigslist_id in craigslist_ids if craigslist_id not in seen]
+        logger.debug('Unseen IDs: %d of %d', len(unseen), len(craigslist_ids))
+        return unseen
+
+    def search_listings(self, min_bedrooms=None, max_bedrooms=None, min_price=None, max_price=None, provider=None, since=None, text=None,
+            near=None, miles=None, duplicates=False, order_by='posted', limit=50):
+        conditions = []
+        parameters = []
+
+        def where(condition, *values):
+            conditions.append(condition)
+            parameters.extend(values)
+
+        if min_bedrooms is not None:
+            where('bedrooms >= ?', min_bedrooms)
+        if max_bedrooms is not None:
+            where('bedrooms <= ?', max_bedrooms)
+        if min_price is not None:
+            where('price >= ?', min_price)
+        if max_price is not None:
+            where('price <= ?', max_price)
+        if provider:
+            where('provider = ? COLLATE NOCASE', provider)
+        if since is not None:
+            where('posted_at >= ?', int(since))
+        if not duplicates:
+            where('duplicate_of IS NULL')
+        if text:
+            if not self.full_text:
+                raise ValueError('Full text search needs SQLite with FTS5')
+            where('rowid IN (SELECT rowid FROM craigslist_housing_fts WHERE craigslist_housing_fts MATCH ?)', text)
+        if near and miles is not None:
+            # Cheap bounding box in SQL, the exact distance is checked below
+            (south, north, west, east) = bounding_box(near[0], near[1], miles)
+            where('latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?', south, north, west, east)
+
+        orders = {
+            'posted': 'posted_at DESC',
+            'price': 'price IS NULL, price ASC',
+            'bedrooms': 'bedrooms DESC, price ASC',
+            'value': 'price_per_person IS NULL, price_per_person ASC',
+        }
+        select = 'SELECT * FROM craigslist_housing'
+        if conditions:
+            select += ' WHERE ' + ' AND '.join(conditions)
+        select += ' ORDER BY ' + orders.get(order_by, orders['posted'])
+        if limit and not near:
+            select += f' LIMIT {int(limit)}'
+
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute(select, parameters)
+            columns = [column[0] for column in cursor.description]
+            listings = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+        if near:
+            for listing in listings:
+                located = listing['latitude'] is not None and listing['longitude'] is not None
+                listing['distance'] = haversine(near[0], near[1], listing['latitude'], listing['longitude']) if located else None
+            if miles is not None:
+                listings = [listing for listing in listings if listing['distance'] is not None and listing['distance'] <= miles]
+            if order_by == 'distance':
+                listings.sort(key=lambda listing: (listing['distance'] is None, listing['distance'] or 0))
+            listings = listings[:limit] if limit else listings
+
+        return listings
+
+    def queue_housing_listing(self, listing):
+        with self.lock:
+            self.pending_listings.append(listing)
+
+    def queue_fingerprint(self, fingerprint):
+        with self.lock:
+            self.pending_fingerprints.append(fingerprint)
+
+    def find_duplicate(self, fingerprint, max_distance=3, cell_distance=18, since=0):
+        # Candidates seen since `since` share the address, a simhash band or a neighbouring grid cell, Fingerprint.matches decides
+        select = ''' SELECT craigslist_id, address, cell_lat, cell_lon, bedrooms, bathrooms, price_band, body_hash FROM listing_fingerprints
+            WHERE craigslist_id != ? AND created_at >= ? AND (address = ? OR band0 = ? OR band1 = ? OR band2 = ? OR band3 = ?
+                OR (cell_lat BETWEEN ? AND ? AND cell_lon BETWEEN ? AND ?)) '''
+
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute(select, (fingerprint.listing_id, int(since), fingerprint.address) + fingerprint.body_bands() + fingerprint.cell_range())
+            candidates = [Fingerprint.from_row(row) for row in cursor.fetchall()] + list(self.pending_fingerprints)
+
+        for candidate in candidates:
+            if fingerprint.matches(candidate, max_distance, cell_distance):
+                logger.debug('Listing %s duplicates %s', fingerprint.listing_id, candidate.listing_id)
+                return candidate.listing_id
+        return None
+
+    def queue_outbox(self, message):
+        with self.lock:
+            self.pending_outbox.append(message)
+
+    def pending_count(self):
+        with self.lock:
+            return len(self.pending_listings)
+
+    def due_outbox(self, now, max_attempts):
+        select = ''' SELECT rowid, craigslist_id, kind, sort_key, attachments, reply, ts, attempts, created_at FROM outbox
+            WHERE sent_at IS NULL AND next_attempt_at <= ? AND attempts < ? ORDER BY rowid '''
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute(select, (int(now), max_attempts))
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def abandoned_count(self, max_attempts):
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute('SELECT COUNT(*) FROM outbox WHERE sent_at IS NULL AND attempts >= ?', (max_attempts,))
+            return cursor.fetchone()[0]
+
+    def requeue_outbox(self, max_attempts):
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute('UPDATE outbox SET attempts = 0, next_attempt_at = ? WHERE sent_at IS NULL AND attempts >= ?', (int(time.time()), max_attempts))
+            self.connection.commit()
+            return cursor.rowcount
+
+    def outbox_posted(self, rowid, ts):
+        # Stored before the reply goes out, so a retry never posts the parent twice
+        with self.lock:
+            self.connection.execute('UPDATE outbox SET ts = ? WHERE rowid = ?', (ts, rowid))
+            self.connection.commit()
+
+    def outbox_sent(self, rowids, ts, reply_ts=None):
+        with self.lock:
+            self.connection.executemany('UPDATE outbox SET ts = ?, reply_ts = ?, sent_at = ?, last_error = NULL WHERE rowid = ?',
+                [(ts, reply_ts, int(time.time()), rowid) for rowid in rowids])
+            self.connection.commit()
+
+    def outbox_failed(self, rowids, next_attempt_at, error):
+        with self.lock:
+            self.connection.executemany('UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE rowid = ?',
+                [(int(next_attempt_at), error, rowid) for rowid in rowids])
+            self.connection.commit()
+
+    def insert_housing_listings(self, listings, fingerprints=(), outbox=()):
+        insert_fingerprint = ''' INSERT OR IGNORE INTO listing_fingerprints (craigslist_id, address, cell_lat, cell_lon, bedrooms, bathrooms, price_band,
+            body_hash, band0, band1, band2, band3, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '''
+        insert_outbox = ''' INSERT OR IGNORE INTO outbox (craigslist_id, kind, sort_key, attachments, reply, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?) '''
+        columns = ['craigslist_id', 'name', 'url', 'craigslist_date', 'created_at'] + [name for (name, column_type) in self.listing_columns]
+        insert = f''' INSERT OR IGNORE INTO craigslist_housing ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) '''
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.executemany(insert, listings)
+            cursor.executemany(insert_fingerprint, [fingerprint.row() + (int(time.time()),) for fingerprint in fingerprints])
+            cursor.executemany(insert_outbox, outbox)
+            self.connection.commit()
+
+            if self.seen_filter:
+                for listing in listings:
+                    self.seen_filter.add(str(listing[0]))
+                cursor.execute('SELECT MAX(rowid) FROM craigslist_housing')
+                self.seen_filter.marker = cursor.fetchone()[0] or 0
+        logger.debug('Inserted %d listings', len(listings))
+
+    def flush_housing_listings(self):
+        with self.lock:
+            (listings, self.pending_listings) = (self.pending_listings, [])
+            (fingerprints, self.pending_fingerprints) = (self.pending_fingerprints, [])
+            (outbox, self.pending_outbox) = (self.pending_outbox, [])
+
+        # Listings, fingerprints and their notifications are committed together
+        if listings or fingerprints or outbox:
+            self.insert_housing_listings(listings, fingerprints, outbox)
 
 @click.command()
 @click.option('--log-level', default='INFO')
 @click.option('--notify/--no-notify', default=True)
+@click.option('--retry-outbox', is_flag=True, help='Send again notifications that ran out of attempts')
 
-def main(log_level, notify):
-    housing_bot = HousingBot(log_level=log_level, notify=notify)
+def main(log_level, notify, retry_outbox):
+    housing_bot = HousingBot(log_level=log_level, notify=notify, requeue_outbox=retry_outbox)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,121 @@
+from craigslist import CraigslistHousing, RESULTS_PER_REQUEST, CraigslistBase, requests_get
+
+import craigslist
+from craigslist_parser import CraigslistDetailParser
+from housing_provider import ListingProvider
+from bot.pipeline import batched
+from bot.dates import parse_date
+
+import logging
+
+# Override to use https
+CraigslistBase.url_templates = url_templates = {
+    'base': 'https://%(site)s.craigslist.org',
+    'no_area': 'https://%(site)s.craigslist.org/search/%(category)s',
+    'area': 'https://%(site)s.craigslist.org/search/%(area)s/%(category)s'
+}
+
+def use_http_client(http):
+    # python-craigslist looks up requests_get at call time, route its search pages through the shared client
+    craigslist.requests_get = http.requests_get
+
+class CraigslistHousingCustom(CraigslistDetailParser, CraigslistHousing):
+
+    def __init__(self, *args, **kwargs):
+        self.latest_date = None
+        self.http = None
+        self.detail_max_age = None
+        super().__init__(*args, **kwargs)
+
+    def get_new_results(self, unseen_ids, high_water=None, stop_after=RESULTS_PER_REQUEST, **kwargs):
+        # Results come newest first: yield the unseen ones and stop requesting pages
+        # once `stop_after` results in a row were already known or older than `high_water`
+        self.latest_date = high_water
+        known_in_row = 0
+
+        for page in batched(self.get_results(**kwargs), RESULTS_PER_REQUEST):
+            unseen = set(unseen_ids([result['id'] for result in page]))
+
+            for result in page:
+                date = result['timestamp'] = self.result_date(result)
+                if date and (self.latest_date is None or date > self.latest_date):
+                    self.latest_date = date
+
+                is_older = high_water is not None and date is not None and date < high_water
+                if result['id'] in unseen:
+                    yield result
+
+                if result['id'] in unseen and not is_older:
+                    known_in_row = 0
+                else:
+                    known_in_row += 1
+
+                if known_in_row >= stop_after:
+                    self.logger.info(f'Stopping after {known_in_row} known results in a row')
+                    return
+
+    def fetch_page(self, url):
+        # Detail pages don't change once posted, so a stored copy is served without a request
+        if self.http:
+            response = self.http.get(url, max_age=self.detail_max_age)
+        else:
+            response = requests_get(url, logger=self.logger)
+        self.logger.info('GET %s', response.url)
+        response.raise_for_status()
+        return response.content
+
+    def result_date(self, result):
+        if result['datetime']:
+            return int(parse_date(result['datetime']).timestamp())
+        return None
+
+class CraigslistProvider(ListingProvider):
+
+    name = 'craigslist'
+
+    def __init__(self, bot):
+        super().__init__(bot)
+        self.queries = {}
+        self.high_waters = {}
+        use_http_client(bot.http)
+
+    def query(self, search):
+        # Building a query fetches the site's filter list, so reuse it across runs
+        search_key = self.search_key(search)
+        if search_key not in self.queries:
+            query = CraigslistHousingCustom(site=search.get('site', 'sfbay'), area=search.get('area', 'sby'), category=search.get('category', 'apa'),
+                filters=search.get('filters'), log_level=logging.INFO)
+            query.engine = self.bot.detail_parser
+            query.http = self.bot.http
+            query.detail_max_age = self.bot.http_config['detail_max_age']
+            self.queries[search_key] = query
+        return self.queries[search_key]
+
+    def search(self, search, unseen_ids):
+        search_key = self.search_key(search)
+        query = self.query(search)
+
+        high_water = None
+        stop_after = RESULTS_PER_REQUEST
+        if self.bot.incremental['enabled']:
+            high_water = self.bot.db.get_high_water(search_key)
+            stop_after = self.bot.incremental['stop_after']
+
+        yield from query.get_new_results(unseen_ids, high_water=high_water, stop_after=stop_after, sort_by='newest', geotagged=False, include_details=False)
+
+        if query.latest_date:
+            self.high_waters[search_key] = query.latest_date
+
+    def enrich(self, search, listing):
+        query = self.query(search)
+        metrics = self.bot.metrics
+        with metrics.timer('craigslist_fetch'):
+            content = query.fetch_page(listing['url'])
+        metrics.increment('pages_fetched')
+        with metrics.timer('craigslist_parse'):
+            query.parse_content(listing, content)
+
+    def finish(self):
+        (high_waters, self.high_waters) = (self.high_waters, {})
+        for (search_key, high_water) in high_waters.items():
+            self.bot.db.set_high_water(search_key, high_water)
@@ -0,0 +1,80 @@
+from housing import SQL
+from bot.geo import parse_point
+
+import datetime
+import logging
+import click
+import json
+import time
+import os
+
+def resolve_point(near, db_file):
+    # "lat,lon", or an address geocoded by an earlier run (see maps.geocode in housing.yaml)
+    point = parse_point(near)
+    if point:
+        return point
+
+    from bot.geocode import GeocodeCache
+    geocodes = GeocodeCache(os.path.splitext(db_file)[0] + '.geocode.db')
+    entry = geocodes.read(geocodes.address_key(near))
+    if entry and entry['latitude'] is not None:
+        return (entry['latitude'], entry['longitude'])
+
+    raise click.BadParameter(f'Not a "lat,lon" pair or a geocoded address: {near}', param_hint='--near')
+
+def format_listing(listing):
+    posted = datetime.datetime.fromtimestamp(listing['posted_at']).strftime('%Y-%m-%d') if listing['posted_at'] else 'N/A'
+    price = f'${listing["price"]:,.0f}' if listing['price'] is not None else 'N/A'
+    rooms = f'{listing["bedrooms"]:g}BR / {listing["bathrooms"]:g}Ba' if listing['bedrooms'] is not None and listing['bathrooms'] is not None else 'N/A'
+    value = f'${listing["price_per_person"]:,.0f}/pp' if listing.get('price_per_person') is not None else 'N/A'
+    distance = f' {listing["distance"]:.1f}mi' if listing.get('distance') is not None else ''
+    return f'{posted} {listing["provider"] or "?":<10} {price:>8} {rooms:<12} {value:>9} {listing.get("band") or "unknown":<7}{distance} {listing["name"]} {listing["url"]}'
+
+@click.command()
+@click.option('--db-file', default=os.path.dirname(os.path.realpath(__file__)) + '/housing.db')
+@click.option('--bedrooms', type=float, help='Exact number of bedrooms')
+@click.option('--min-bedrooms', type=float)
+@click.option('--min-price', type=float)
+@click.option('--max-price', type=float)
+@click.option('--provider', help='craigslist or zillow')
+@click.option('--days', type=float, help='Only listings posted in the last N days')
+@click.option('--text', help='Full text search over name and body, e.g. "garage OR yard"')
+@click.option('--near', help='"lat,lon" or a geocoded address')
+@click.option('--miles', type=float, help='Maximum distance from --near')
+@click.option('--sort', type=click.Choice(['posted', 'price', 'bedrooms', 'value', 'distance']), default='posted',
+    help='value sorts by price per person, cheapest first')
+@click.option('--limit', type=int, default=50)
+@click.option('--duplicates/--no-duplicates', default=False, help='Include listings found to duplicate another')
+@click.option('--json', 'as_json', is_flag=True, help='One JSON object per line')
+
+def main(db_file, bedrooms, min_bedrooms, min_price, max_price, provider, days, text, near, miles, sort, limit, duplicates, as_json):
+    # e.g. 4BR under $5k within 3 miles, last 30 days:
+    # python3 housing_history.py --bedrooms 4 --max-price 5000 --near 37.39,-122.08 --miles 3 --days 30
+    logging.basicConfig(level=logging.WARNING)
+
+    db = SQL(db_file=db_file)
+    db.open()
+    db.create_table()
+
+    try:
+        listings = db.search_listings(
+            min_bedrooms=bedrooms if bedrooms is not None else min_bedrooms,
+            max_bedrooms=bedrooms,
+            min_price=min_price,
+            max_price=max_price,
+            provider=provider,
+            since=time.time() - days * 86400 if days is not None else None,
+            text=text,
+            near=resolve_point(near, db_file) if near else None,
+            miles=miles,
+            duplicates=duplicates,
+            order_by=sort,
+            limit=limit)
+    finally:
+        db.close()
+
+    for listing in listings:
+        click.echo(json.dumps(listing) if as_json else format_listing(listing))
+
+if __name__ == '__main__':
+    main()
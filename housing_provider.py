@@ -0,0 +1,26 @@
+import hashlib
+import json
+
+class ListingProvider():
+
+    # Key under `searches` in housing.yaml
+    name = None
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    def search_key(self, search):
+        search = json.dumps(search, sort_keys=True)
+        return self.name + ':' + hashlib.sha1(search.encode('utf-8')).hexdigest()
+
+    def search(self, search, unseen_ids):
+        # Yields the listings of one search that `unseen_ids` doesn't know yet
+        raise NotImplementedError
+
+    def enrich(self, search, listing):
+        # Fills in the detail fields (posted, body, image, where, ...) in place
+        raise NotImplementedError
+
+    def finish(self):
+        # Called once per run after the listings are stored
+        pass
@@ -0,0 +1,107 @@
+from bot.fingerprint import parse_price, parse_rooms
+from array import array
+
+import bisect
+import math
+
+class ListingScores():
+
+    # Price per person up to each bound gets that band: over $1600 or suspiciously under $700 is red
+    band_bounds = (700, 1300, 1600)
+    band_names = ('red', 'green', 'orange', 'red')
+
+    def __init__(self, prices, bedrooms, bathrooms):
+        # Columns of floats, NaN where a value is unknown
+        self.prices = array('d', prices)
+        self.bedrooms = array('d', bedrooms)
+        self.bathrooms = array('d', bathrooms)
+
+        self.price_per_person = None
+        self.bands = None
+        # 1 is the best value in the batch, unknown prices come last
+        self.ranks = None
+
+        self.score()
+
+    @classmethod
+    def from_listings(cls, listings):
+        # Parses the price and room strings once per listing
+        return cls([nan_if_none(parse_price(listing.get('price'))) for listing in listings],
+            [nan_if_none(parse_rooms(listing.get('bedrooms'))) for listing in listings],
+            [nan_if_none(parse_rooms(listing.get('bathrooms'))) for listing in listings])
+
+    @classmethod
+    def from_columns(cls, prices, bedrooms, bathrooms):
+        return cls(map(nan_if_none, prices), map(nan_if_none, bedrooms), map(nan_if_none, bathrooms))
+
+    def __len__(self):
+        return len(self.prices)
+
+    def score(self):
+        # NumPy is optional, whole columns at once when it is installed
+        try:
+            import numpy
+        except ImportError:
+            self.score_rows()
+        else:
+            self.score_columns(numpy)
+
+    def score_columns(self, numpy):
+        prices = numpy.frombuffer(self.prices, dtype=numpy.float64)
+        bedrooms = numpy.frombuffer(self.bedrooms, dtype=numpy.float64)
+        bathrooms = numpy.frombuffer(self.bathrooms, dtype=numpy.float64)
+
+        # price per person = price / ((0.7 * beds) + (0.3 * baths)), or price / beds without bathrooms
+        no_bathrooms = numpy.isnan(bathrooms) | numpy.isclose(bathrooms, 0)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            values = prices / numpy.where(no_bathrooms, bedrooms, (0.7 * bedrooms) + (0.3 * bathrooms))
+        values = numpy.where(numpy.isfinite(values), values, -1.0)
+
+        bands = numpy.array(self.band_names, dtype=object)[numpy.searchsorted(self.band_bounds, values, side='left')]
+        bands[values < 0] = 'unknown'
+
+        order = numpy.lexsort((values, values < 0))
+        ranks = numpy.empty(len(values), dtype=numpy.int64)
+        ranks[order] = numpy.arange(1, len(values) + 1)
+
+        self.price_per_person = array('d', values.tobytes())
+        self.bands = bands.tolist()
+        self.ranks = array('q', ranks.tobytes())
+
+    def score_rows(self):
+        bounds = self.band_bounds
+        names = self.band_names
+        self.price_per_person = array('d')
+        self.bands = []
+
+        for (price, bedrooms, bathrooms) in zip(self.prices, self.bedrooms, self.bathrooms):
+            if math.isnan(bathrooms) or math.isclose(bathrooms, 0):
+                people = bedrooms
+            else:
+                people = (0.7 * bedrooms) + (0.3 * bathrooms)
+
+            value = price / people if people else math.nan
+            value = value if math.isfinite(value) else -1.0
+
+            self.price_per_person.append(value)
+            self.bands.append('unknown' if value < 0 else names[bisect.bisect_left(bounds, value)])
+
+        values = self.price_per_person
+        order = sorted(range(len(values)), key=lambda index: (values[index] < 0, values[index]))
+        self.ranks = array('q', bytes(8 * len(values)))
+        for (rank, index) in enumerate(order, start=1):
+            self.ranks[index] = rank
+
+    def order(self):
+        # Indexes from the best value to the worst
+        return sorted(range(len(self.ranks)), key=self.ranks.__getitem__)
+
+    def apply(self, listings):
+        for (index, listing) in enumerate(listings):
+            listing['price_per_person'] = self.price_per_person[index]
+            listing['band'] = self.bands[index]
+            listing['rank'] = self.ranks[index]
+        return listings
+
+def nan_if_none(value):
+    return math.nan if value is None else float(value)
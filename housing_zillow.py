@@ -0,0 +1,169 @@
+from housing_provider import ListingProvider
+from bot.dates import parse_fuzzy_date
+
+import threading
+import datetime
+import logging
+import json
+
+logger = logging.getLogger('housing.zillow')
+
+class ZillowProvider(ListingProvider):
+
+    name = 'zillow'
+
+    # Zillow stops paging after 20 pages of 40, split large areas with `tiles`
+    max_pages = 20
+
+    def __init__(self, bot):
+        super().__init__(bot)
+        # The details stage runs many workers, only this many of them query Zillow at once
+        self.detail_slots = threading.BoundedSemaphore((bot.provider_modules.get(self.name) or {}).get('detail_concurrency', 2))
+
+    def search(self, search, unseen_ids):
+        # search: a searchQueryState plus optional `tiles` (n or [rows, columns] over mapBounds) and `max_pages`
+        query = json.loads(search) if isinstance(search, str) else dict(search)
+        tiles = query.pop('tiles', 1)
+        max_pages = query.pop('max_pages', self.max_pages)
+
+        stop_after = None
+        if self.bot.incremental['enabled']:
+            stop_after = self.bot.incremental['stop_after']
+            # Newest first, so the known listings come after the new ones
+            filters = query['filterState'] = dict(query.get('filterState') or {})
+            filters.setdefault('sortSelection', {'value': 'days'})
+
+        seen = set()
+        for tile in self.tiles(query, tiles):
+            for listing in self.new_listings(tile, unseen_ids, max_pages, stop_after):
+                if listing['id'] not in seen:
+                    seen.add(listing['id'])
+                    yield listing
+
+    def tiles(self, query, tiles):
+        (rows, columns) = (tiles, tiles) if isinstance(tiles, int) else tiles
+        bounds = query.get('mapBounds')
+        if not bounds or rows * columns <= 1:
+            yield query
+            return
+
+        (height, width) = ((bounds['north'] - bounds['south']) / rows, (bounds['east'] - bounds['west']) / columns)
+        for row in range(rows):
+            for column in range(columns):
+                yield {**query, 'mapBounds': {
+                    'south': bounds['south'] + row * height,
+                    'north': bounds['south'] + (row + 1) * height,
+                    'west': bounds['west'] + column * width,
+                    'east': bounds['west'] + (column + 1) * width,
+                }}
+
+    def new_listings(self, query, unseen_ids, max_pages, stop_after=None):
+        # Yields each page's unseen listings as it arrives, stops once `stop_after` known ones came in a row
+        known_in_row = 0
+        for page in range(1, max_pages + 1):
+            (listings, total_pages) = self.fetch_housing({**query, 'pagination': {'currentPage': page}})
+            self.bot.metrics.increment('pages_fetched')
+
+            unseen = set(unseen_ids([listing['id'] for listing in listings]))
+            for listing in listings:
+                if str(listing['id']) in unseen:
+                    known_in_row = 0
+                    yield listing
+                else:
+                    known_in_row += 1
+
+                if stop_after is not None and known_in_row >= stop_after:
+                    logger.info(f'Stopping Zillow search after {known_in_row} known results in a row')
+                    return
+
+            if not listings or page >= total_pages:
+                return
+
+    def enrich(self, search, listing):
+        with self.detail_slots, self.bot.metrics.timer('zillow_details'):
+            self.fetch_details(listing)
+        self.bot.metrics.increment('pages_fetched')
+
+    def fetch_housing(self, query):
+        # One page of results and the number of pages
+        url = 'https://www.zillow.com/search/GetSearchPageState.htm'
+        params = {
+            'searchQueryState': json.dumps(query, separators=(',', ':')),
+            'includeMap': 'false',
+            'includeList': 'true'
+        }
+
+        headers = {
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3',
+            'Accept-Encoding': 'gzip, deflate, br',
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.169 Safari/537.36',
+            'Accept-Language': 'en-US,en;q=0.9',
+            'Cache-Control': 'no-cache',
+            'Pragma': 'no-cache',
+            'Accept-Encoding': 'gzip, deflate, br',
+            'Referrer': 'https://www.zillow.com/homes/?searchQueryState={%22mapBounds%22:{%22west%22:-122.21854364648436,%22east%22:-121.89925348535155,%22south%22:37.268739809818555,%22north%22:37.46410934451267},%22usersSearchTerm%22:%2294040%22,%22isMapVisible%22:true,%22mapZoom%22:12,%22filterState%22:{%22price%22:{%22min%22:0,%22max%22:1584707},%22monthlyPayment%22:{%22min%22:0,%22max%22:6000},%22beds%22:{%22min%22:4,%22max%22:4},%22baths%22:{%22min%22:2},%22sortSelection%22:{%22value%22:%22days%22},%22isForSaleByAgent%22:{%22value%22:false},%22isForSaleByOwner%22:{%22value%22:false},%22isNewConstruction%22:{%22value%22:false},%22isForSaleForeclosure%22:{%22value%22:false},%22isComingSoon%22:{%22value%22:false},%22isAuction%22:{%22value%22:false},%22isPreMarketForeclosure%22:{%22value%22:false},%22isPreMarketPreForeclosure%22:{%22value%22:false},%22isMakeMeMove%22:{%22value%22:false},%22isForRent%22:{%22value%22:true},%22isCondo%22:{%22value%22:false},%22isMultiFamily%22:{%22value%22:false}},%22isListVisible%22:true,%22pagination%22:{%22currentPage%22:2}}',
+        }
+
+        response = self.bot.http.get(url=url, params=params, headers=headers)
+        result = response.json()
+
+        listings = []
+        for entry in result['searchResults']['listResults']:
+            listings.append({
+                'id': entry['zpid'],
+                'name': entry['statusText'] + ' - ' + entry['address'],
+                'price': entry['price'],
+                'bedrooms': entry['beds'],
+                'bathrooms': entry['baths'],
+                'gaddress': entry['address'],
+                'geotag': (entry['latLong']['latitude'], entry['latLong']['longitude']) if entry.get('latLong') else None,
+                'area': str(entry['area']),
+                'url': entry['detailUrl'],
+                'map_accuracy': 0,
+                'rooms': f"{entry['beds']}BR / {entry['baths']}Ba",
+                'provider': 'Zillow'
+            })
+
+        return (listings, (result.get('searchList') or {}).get('totalPages') or 1)
+
+    def fetch_details(self, listing):
+        url = 'https://www.zillow.com/graphql/'
+        payload = '{"operationName":"ForRentDoubleScrollFullRenderQuery","variables":{"zpid":' + listing['id'] + ',"contactFormRenderParameter":{"zpid":19596588,"platform":"desktop","isDoubleScroll":true}},"clientVersion":"home-details/5.44.1.0.0.hotfix-2019-5-28.59e2dc6","queryId":"0b39af348a5c57b66a90385dad30bcab"}'
+
+        headers = {
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3',
+            'Accept-Encoding': 'gzip, deflate, br',
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.169 Safari/537.36',
+            'Accept-Language': 'en-US,en;q=0.9',
+            'Content-Type': 'text/plain',
+            'Cache-Control': 'no-cache',
+            'Pragma': 'no-cache',
+            'Accept-Encoding': 'gzip, deflate, br',
+            'Referrer': 'https://www.zillow.com/homes/?searchQueryState={%22mapBounds%22:{%22west%22:-122.21854364648436,%22east%22:-121.89925348535155,%22south%22:37.268739809818555,%22north%22:37.46410934451267},%22usersSearchTerm%22:%2294040%22,%22isMapVisible%22:true,%22mapZoom%22:12,%22filterState%22:{%22price%22:{%22min%22:0,%22max%22:1584707},%22monthlyPayment%22:{%22min%22:0,%22max%22:6000},%22beds%22:{%22min%22:4,%22max%22:4},%22baths%22:{%22min%22:2},%22sortSelection%22:{%22value%22:%22days%22},%22isForSaleByAgent%22:{%22value%22:false},%22isForSaleByOwner%22:{%22value%22:false},%22isNewConstruction%22:{%22value%22:false},%22isForSaleForeclosure%22:{%22value%22:false},%22isComingSoon%22:{%22value%22:false},%22isAuction%22:{%22value%22:false},%22isPreMarketForeclosure%22:{%22value%22:false},%22isPreMarketPreForeclosure%22:{%22value%22:false},%22isMakeMeMove%22:{%22value%22:false},%22isForRent%22:{%22value%22:true},%22isCondo%22:{%22value%22:false},%22isMultiFamily%22:{%22value%22:false}},%22isListVisible%22:true,%22pagination%22:{%22currentPage%22:2}}',
+        }
+
+        response = self.bot.http.post(url=url, data=payload, headers=headers)
+        result = response.json()
+
+        listing['posted'] = 'N/A'
+
+        for fact in result['data']['property']['homeFacts']['atAGlanceFacts']:
+            if fact['factLabel'] == 'Date available' and fact['factValue']:
+                if fact['factValue'] == 'Available now':
+                    listing['availability'] = datetime.datetime.now()
+                else:
+                    listing['availability'] = parse_fuzzy_date(str(fact['factValue']))
+
+        for category in result['data']['property']['homeFacts']['categoryDetails']:
+            if category['categoryGroupName'] == 'Rental Facts':
+                category = category['categories'][0]
+                for fact in category['categoryFacts']:
+                    if fact['factLabel'] == 'Posted':
+                        listing['posted'] = parse_fuzzy_date(fact['factValue'])
+
+        if listing['posted'] == 'N/A':
+            listing['posted'] = parse_fuzzy_date(result['data']['property']['timeOnZillow'])
+
+        listing['body'] = result['data']['property']['description']
+        listing['image'] = result['data']['property']['desktopWebHdpImageLink']
+        listing['where'] = result['data']['property']['city']
@@ -0,0 +1,30 @@
+from bot.scheduler import Scheduler
+from bot.logger import Logger
+from bot.configurator import Configurator
+
+import importlib
+import logging
+import click
+import os
+
+@click.command()
+@click.option('--log-level', default='INFO')
+@click.option('--config-file', default=os.path.splitext(os.path.realpath(__file__))[0] + '.yaml')
+
+def main(log_level, config_file):
+    Logger(log_file=os.path.splitext(os.path.realpath(__file__))[0] + '.log', log_level=log_level, **Configurator.logging_options(config_file))
+    config = Configurator(config_file=config_file).config
+
+    scheduler = Scheduler(max_workers=config.get('max_workers', 4))
+
+    # Each bot is built once, keeping its Slack client and database warm between runs
+    for job in config['jobs']:
+        module = importlib.import_module(job['module'])
+        bot = getattr(module, job['class'])(log_level=log_level, autorun=False, **job.get('options', {}))
+        scheduler.add_job(job['name'], bot, interval=job.get('interval'), cron=job.get('cron'), jitter=job.get('jitter', 0), run_at_start=job.get('run_at_start', False))
+        logging.info(f'Scheduled {job["name"]}')
+
+    scheduler.start()
+
+if __name__ == '__main__':
+    main()